@@ -0,0 +1,263 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Benchmarks of the stages, loaders and pivot engines of the ETL
+              process on synthetic data (see generate_data.py)
+"""
+import argparse
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import sqlalchemy
+import yaml
+from yaml.loader import SafeLoader
+from DBToolBox.DataConnectors import get_alchemy_engine_db, insert_db
+import etl
+import generate_data
+import instrument
+import sql
+
+PIVOT_TABLES = ["anime-votes-raw", "anime-votes-pct"]
+JOIN_TABLES = ["anime-stats-scores-raw", "anime-stats-scores-pct"]
+MB = 1 << 20
+
+
+def make_scores(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Returns a synthetic DataFrame shaped like the cleaned anime_scores data"""
+    rng = np.random.default_rng(seed)
+    anime = -(-rows // 10)
+    votes = rng.integers(0, 50000, size=anime * 10)
+    totals = votes.reshape(-1, 10).sum(axis=1).repeat(10)
+    df = pd.DataFrame(
+        {
+            "anime_id": np.arange(1, anime + 1).repeat(10),
+            "score": np.tile(np.arange(1, 11), anime),
+            "votes": votes,
+            "percentage": np.round(votes / np.maximum(totals, 1) * 100, 1),
+            "load_date": pd.Timestamp("2022-06-27"),
+        }
+    )
+    return df.head(rows)
+
+
+def time_call(func, *args, **kwargs) -> float:
+    """Returns the wall clock time in seconds that the given call took"""
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def bench_loaders(engine, df: pd.DataFrame, schema: str, chunksize: int) -> dict:
+    """Loads the DataFrame with each loader and returns the timings in seconds"""
+    results = {
+        "insert_db": time_call(
+            insert_db, df, "bench_insert", schema, engine=engine, if_exists="replace"
+        ),
+        "copy_db": time_call(
+            etl.copy_db, df, "bench_copy", schema, engine, chunksize=chunksize
+        ),
+    }
+    with engine.connect() as conn:
+        etl.execute_sql(
+            conn,
+            [
+                f"DROP TABLE IF EXISTS {schema}.bench_insert;",
+                f"DROP TABLE IF EXISTS {schema}.bench_copy;",
+            ],
+        )
+    return results
+
+
+def bench_pivot(config: dict, df: pd.DataFrame) -> dict:
+    """
+    Builds both votes tables with create_pivot_table and with the single-pass
+    create_pivot_tables, checks that the outputs are identical and returns the
+    timings in seconds
+    """
+    start = time.perf_counter()
+    expected = [etl.create_pivot_table(df, config, table) for table in PIVOT_TABLES]
+    results = {"pivot_table": time.perf_counter() - start}
+    start = time.perf_counter()
+    actual = etl.create_pivot_tables(df, config, PIVOT_TABLES)
+    results["create_pivot_tables"] = time.perf_counter() - start
+    for table, got, want in zip(PIVOT_TABLES, actual, expected):
+        try:
+            pd.testing.assert_frame_equal(got, want)
+        except AssertionError as err:
+            raise AssertionError(f"{table} does not match pivot_table") from err
+    return results
+
+
+def measure(results: list, stage: str, func, *args, trace: bool = True):
+    """
+    Runs one stage and appends its wall and CPU time, peak memory allocated
+    while it ran, and the rows and memory of the DataFrames it produced to
+    @param results. Returns the stage's output. Tracing allocations slows down
+    I/O-bound stages a lot, so with trace=False the peak is not measured.
+    """
+    if trace:
+        tracemalloc.start()
+    wall, cpu = time.perf_counter(), time.process_time()
+    output = func(*args)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    peak = None
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    frames = instrument.frames_of(output)
+    # Loads return the number of rows written per table instead of DataFrames
+    rows = sum(len(df) for df in frames)
+    if isinstance(output, dict) and not frames:
+        rows = sum(output.values())
+    results.append(
+        {
+            "stage": stage,
+            "seconds": round(wall, 3),
+            "cpu_seconds": round(cpu, 3),
+            "peak_mb": None if peak is None else round(peak / MB, 1),
+            "rows": rows,
+            "frame_mb": round(
+                sum(df.memory_usage(deep=True).sum() for df in frames) / MB, 1
+            ),
+            "max_rss_mb": instrument.peak_rss_mb(),
+        }
+    )
+    peak = "-" if peak is None else f"{peak / MB:.1f}"
+    print(f"{stage:>32}: {wall:8.2f}s {peak:>10} MB peak {rows:>12,} rows")
+    return output
+
+
+def load_frames(config: dict, data: dict, engine) -> dict:
+    """
+    Loads the produced tables the way initial_etl does on Postgres. Any other
+    database (e.g. a file-backed SQLite stand-in) gets plain pandas INSERTs
+    without schemas.
+    """
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            etl.execute_sql(conn, [sql.ENSURE_SCHEMA])
+        return etl.load_data_concurrent(config, data, engine)
+    for table, df in data.items():
+        df.to_sql(config[table]["tablename"], engine, if_exists="replace", index=False)
+    return {table: len(df) for table, df in data.items()}
+
+
+def bench_stages(config: dict, paths: list, engine=None) -> list:
+    """
+    Runs the stages of initial_etl.main one after another on the raw data at the
+    given paths (in raw-data-loc order) and returns the measurements of each.
+    The load stage is skipped without an engine.
+    """
+    results = []
+    data = {}
+    for table, path in zip(config["source-tables"], paths):
+        definition = config[table]
+        (raw,) = measure(
+            results,
+            f"ingest/{table}",
+            etl.ingest_raw_data,
+            [path],
+            [definition.get("csv-schema")],
+            config.get("csv-engine"),
+            [definition.get("csv-chunksize")],
+        )
+        data[table] = measure(
+            results, f"clean/{table}", etl.clean_data, raw, definition
+        )
+    pivots = measure(
+        results,
+        "pivot",
+        etl.create_pivot_tables,
+        data["anime-scores"],
+        config,
+        PIVOT_TABLES,
+    )
+    data.update(zip(PIVOT_TABLES, pivots))
+    data.update(measure(results, "join", etl.join_tables, config, data, JOIN_TABLES))
+    if engine is not None:
+        measure(results, "load", load_frames, config, data, engine, trace=False)
+    return results
+
+
+def run_stages(config: dict, args: argparse.Namespace):
+    """Benchmarks every stage and writes the JSON report"""
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = (
+            [f"{args.data}/{name}.csv" for name in generate_data.FILES]
+            if args.data
+            else generate_data.generate(tmp, args.anime, seed=args.seed)
+        )
+        engine = None
+        if args.db_url != "none":
+            engine = sqlalchemy.create_engine(
+                args.db_url or f"sqlite:///{tmp}/bench.db"
+            )
+        try:
+            results = bench_stages(config, paths, engine)
+        finally:
+            if engine is not None:
+                engine.dispose()
+    report_data = {
+        "anime": None if args.data else args.anime,
+        "data": args.data,
+        "database": engine.dialect.name if engine is not None else None,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "stages": results,
+        "total_seconds": round(sum(stage["seconds"] for stage in results), 3),
+    }
+    with open(args.report, "w", encoding="utf-8") as file:
+        json.dump(report_data, file, indent=2)
+    print(f"Report written to {args.report}")
+
+
+def report(results: dict, rows: int):
+    """Prints the timings of a benchmark, the first entry being the baseline"""
+    for name, seconds in results.items():
+        print(f"{name:>20}: {seconds:8.2f}s ({rows / seconds:,.0f} rows/s)")
+    baseline, candidate = results.values()
+    print(f"{'speedup':>20}: {baseline / candidate:.1f}x")
+
+
+def main():
+    """Runs the benchmarks from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("stage", choices=["stages", "loaders", "pivot"])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--chunksize", type=int, default=100000)
+    parser.add_argument("--schema", default="public")
+    stages = parser.add_argument_group("stages")
+    stages.add_argument("--anime", type=int, default=10000, help="synthetic scale")
+    stages.add_argument("--seed", type=int, default=0)
+    stages.add_argument("--data", help="directory with existing raw CSVs to use")
+    stages.add_argument(
+        "--db-url",
+        help="SQLAlchemy URL to load into, e.g. a throwaway Postgres "
+        "(default: a temporary SQLite file, 'none' to skip the load)",
+    )
+    stages.add_argument("--report", default="bench-report.json")
+    args = parser.parse_args()
+    with open(r"tables.yml", "r", encoding="utf-8") as file:
+        config = yaml.load(file, Loader=SafeLoader)
+    if args.stage == "stages":
+        run_stages(config, args)
+        return
+    df = make_scores(args.rows)
+    if args.stage == "pivot":
+        report(bench_pivot(config, df), len(df))
+        return
+    engine = get_alchemy_engine_db()
+    try:
+        results = bench_loaders(engine, df, args.schema, args.chunksize)
+    finally:
+        engine.dispose()
+    report(results, len(df))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: A content-addressed on-disk cache of the stage outputs of the
+              ETL process, stored as Arrow IPC files
+"""
+import hashlib
+import json
+import logging
+import os
+import pandas as pd
+import pyarrow as pa
+
+BLOCK_SIZE = 1 << 20
+
+
+def hash_file(path: str) -> str:
+    """Returns the SHA-256 digest of the contents of the given file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def code_version(paths: list) -> str:
+    """
+    Returns a digest of the given source files and of the pandas and pyarrow
+    versions, used to invalidate the cache
+    """
+    return stage_key(
+        *[hash_file(path) for path in paths], pd.__version__, pa.__version__
+    )
+
+
+def stage_key(*parts) -> str:
+    """
+    Returns the cache key for a stage from the given parts (input digests,
+    table definitions from tables.yml, code version...)
+    """
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def entry_path(directory: str, key: str) -> str:
+    """Returns the path of the cache entry for the given key"""
+    return os.path.join(directory, f"{key}.arrow")
+
+
+def load(directory: str, key: str):
+    """Returns the cached DataFrame for the given key, or None on a miss"""
+    path = entry_path(directory, key)
+    try:
+        # Mark the entry as recently used for eviction
+        os.utime(path)
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+    except FileNotFoundError:
+        # Missing, or evicted by another worker in the meantime
+        return None
+    df = table.to_pandas()
+    # Restore what Arrow cannot represent: non-string column labels, object
+    # columns that Arrow stores with a narrower type (e.g. Python bools) and the
+    # storage of string columns and nullable dtypes of the index
+    layout = json.loads(table.schema.metadata[b"etl-layout"])
+    df.columns = pd.Index(layout["columns"], name=layout["name"])
+    for col, dtype in layout["dtypes"].items():
+        df[df.columns[int(col)]] = df.iloc[:, int(col)].astype(dtype)
+    if str(df.index.dtype) != layout["index"]:
+        df.index = df.index.astype(layout["index"])
+    return df
+
+
+def store(directory: str, key: str, df):
+    """Writes the given DataFrame to the cache under the given key"""
+    os.makedirs(directory, exist_ok=True)
+    layout = {
+        "columns": list(df.columns),
+        "name": df.columns.name,
+        "index": str(df.index.dtype),
+        "dtypes": {
+            i: f"string[{dtype.storage}]"
+            if isinstance(dtype, pd.StringDtype)
+            else "object"
+            for i, dtype in enumerate(df.dtypes)
+            if dtype == object or isinstance(dtype, pd.StringDtype)
+        },
+    }
+    # The labels are restored from the layout, so Arrow only gets strings
+    table = pa.Table.from_pandas(df.set_axis(list(map(str, df.columns)), axis=1))
+    table = table.replace_schema_metadata(
+        {**table.schema.metadata, b"etl-layout": json.dumps(layout)}
+    )
+    path = entry_path(directory, key)
+    # Write to a temporary file first so readers never see a partial entry
+    with pa.OSFile(f"{path}.tmp", "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(f"{path}.tmp", path)
+
+
+def evict(directory: str, max_bytes: int):
+    """
+    Removes the least recently used entries until the cache fits in max_bytes.
+    Entries another worker removed in the meantime are skipped.
+    """
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(".arrow"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    size = sum(entry_size for _, entry_size, _ in entries)
+    for _, entry_size, path in entries:
+        if size <= max_bytes:
+            break
+        size -= entry_size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        logging.info("Evicted %s from the stage cache", path)
+
+
+def cached(config: dict, keys: dict, compute) -> dict:
+    """
+    Returns the DataFrames of a stage as a dict keyed by table. They are loaded
+    from the cache when every table in @param keys has an entry, otherwise they
+    are produced by calling compute() and stored. A config of None disables the
+    cache.
+    """
+    if config is None:
+        return compute()
+    directory = config["dir"]
+    frames = {table: load(directory, key) for table, key in keys.items()}
+    if all(df is not None for df in frames.values()):
+        logging.info("Loaded %s from the stage cache", ", ".join(keys))
+        return frames
+    frames = compute()
+    for table, key in keys.items():
+        store(directory, key, frames[table])
+    evict(directory, config["max-size-mb"] * (1 << 20))
+    return frames
@@ -0,0 +1,77 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Builds the dimension tables of the COOP-DA-Database, only
+              rebuilding or extending them when their definition changes
+"""
+from datetime import timedelta
+import logging
+from sqlalchemy import text
+import cache
+import etl
+import sql
+
+
+def fingerprint(*definition) -> str:
+    """Returns the version fingerprint of a dimension from its SQL definition"""
+    return cache.stage_key(*definition)
+
+
+def missing_ranges(stored_start, stored_end, start, end) -> list:
+    """
+    Returns the (first, last) day ranges of start..end that the stored range
+    stored_start..stored_end does not cover yet
+    """
+    day = timedelta(days=1)
+    ranges = []
+    if start < stored_start:
+        ranges.append((start, min(end, stored_start - day)))
+    if end > stored_end:
+        ranges.append((max(start, stored_end + day), end))
+    return ranges
+
+
+def ensure_dim_day(conn, options: dict) -> bool:
+    """
+    Makes public.dim_day cover the days from options["start"] to options["end"].
+    It is rebuilt when there is no stored fingerprint or when its definition
+    changed, extended with only the missing days when the range grew, and left
+    untouched otherwise. Returns whether its content changed.
+    """
+    version = fingerprint(sql.CREATE_DIM_DAY, sql.RESET_DIM_DAY, sql.INSERT_DIM_DAY)
+    start, end = options["start"], options["end"]
+    with conn.begin():
+        etl.execute_sql(conn, [sql.CREATE_ETL_METADATA, sql.CREATE_DIM_DAY])
+        stored = conn.execute(
+            text(sql.SELECT_ETL_METADATA), {"name": "dim_day"}
+        ).fetchone()
+        if stored is None or stored.fingerprint != version:
+            logging.info("Building dim_day from %s to %s", start, end)
+            etl.execute_sql(
+                conn,
+                [sql.RESET_DIM_DAY, sql.INSERT_DIM_DAY.format(start=start, end=end)],
+            )
+        else:
+            ranges = missing_ranges(stored.range_start, stored.range_end, start, end)
+            if not ranges:
+                logging.info("dim_day is up to date")
+                return False
+            for first, last in ranges:
+                logging.info("Extending dim_day from %s to %s", first, last)
+                etl.execute_sql(
+                    conn, [sql.INSERT_DIM_DAY.format(start=first, end=last)]
+                )
+            start = min(start, stored.range_start)
+            end = max(end, stored.range_end)
+        # Day keys looked up before the change are stale
+        etl.dim_day_keys.cache_clear()
+        conn.execute(
+            text(sql.UPSERT_ETL_METADATA),
+            {
+                "name": "dim_day",
+                "fingerprint": version,
+                "range_start": start,
+                "range_end": end,
+            },
+        )
+    return True
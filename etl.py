@@ -4,24 +4,360 @@
 @Description: A collection of functions to perform the ETL process
               for the initial COOP Data Analytics DB Environment
 """
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import copy
+from functools import lru_cache
+from io import StringIO
+import logging
+import os
+import threading
 from DBToolBox.DataConnectors import insert_db
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+import pyarrow as pa
+from pyarrow import csv
+from sqlalchemy import text, types
+from sqlalchemy.dialects import postgresql
+import sql
+import instrument
+import cache
+import export
+
+# Marker written for missing values when streaming frames through COPY
+COPY_NULL = r"\N"
+MB = 1 << 20
+# Postgres types of the (compacted) pandas dtypes, by dtype kind and item size.
+# Postgres has no 1-byte integer, so 8-bit integers are stored as SMALLINT.
+SQL_TYPES = {
+    ("b", 1): types.Boolean,
+    ("i", 1): types.SmallInteger,
+    ("i", 2): types.SmallInteger,
+    ("i", 4): types.Integer,
+    ("i", 8): types.BigInteger,
+    ("u", 1): types.SmallInteger,
+    ("u", 2): types.Integer,
+    ("u", 4): types.BigInteger,
+    ("f", 4): types.REAL,
+    ("f", 8): types.Float,
+}
+
+
+class LoadError(Exception):
+    """
+    Raised when one or more tables fail to load, with the error of each table
+    and the rows loaded into each of the tables that were loaded in full
+    """
+
+    def __init__(self, errors: dict, rows: dict = None):
+        self.errors = errors
+        self.rows = rows or {}
+        super().__init__(
+            "Failed to load "
+            + ", ".join(f"{table} ({err!r})" for table, err in errors.items())
+        )
 
 
 # Extract
-def ingest_raw_data(paths: list) -> list:
-    """Returns a DataFrame for each of the valid given paths"""
+def schema_dtypes(schema: dict) -> dict:
+    """Returns the read_csv dtypes declared in the given csv-schema"""
+    dtypes = dict(schema.get("dtypes", {}))
+    for col in schema.get("categories", []):
+        dtypes[col] = "category"
+    return dtypes
+
+
+def parse_dates(df: pd.DataFrame, dates: dict) -> pd.DataFrame:
+    """Parses the given date columns using their declared formats"""
+    for col, fmt in dates.items():
+        df[col] = pd.to_datetime(df[col], format=fmt)
+    return df
+
+
+def read_raw_data(path: str, schema: dict = None, engine: str = None, chunksize=None):
+    """
+    Yields the data at the given path as DataFrame chunks typed according to
+    the source's csv-schema (used columns, dtypes, categories and date formats).
+    The whole file is yielded as a single chunk when no chunksize is given.
+    """
+    schema = schema or {}
+    options = {
+        "on_bad_lines": "skip",
+        "usecols": schema.get("usecols"),
+        "dtype": schema_dtypes(schema),
+    }
+    if chunksize:
+        # The pyarrow engine cannot read in chunks
+        with pd.read_csv(path, chunksize=chunksize, **options) as reader:
+            for chunk in reader:
+                yield parse_dates(chunk, schema.get("dates", {}))
+    elif engine == "pyarrow":
+        df = read_csv_pyarrow(
+            path, options["usecols"], options["dtype"], schema.get("dates", {})
+        )
+        yield parse_dates(df, schema.get("dates", {}))
+    else:
+        df = pd.read_csv(path, engine=engine, **options)
+        yield parse_dates(df, schema.get("dates", {}))
+
+
+def read_csv_pyarrow(path: str, usecols: list, dtypes: dict, dates: dict):
+    """
+    Reads a CSV with pyarrow, skipping malformed rows like on_bad_lines="skip"
+    (which pandas before 2.2 does not support with its pyarrow engine). The
+    @param dates are read as text, to be parsed like the c parser's
+    """
+    table = csv.read_csv(
+        path,
+        parse_options=csv.ParseOptions(invalid_row_handler=lambda row: "skip"),
+        convert_options=csv.ConvertOptions(
+            include_columns=usecols or [],
+            column_types={col: pa.string() for col in dates},
+        ),
+    )
+    return table.to_pandas().astype(dtypes)
+
+
+def type_raw_data(df: pd.DataFrame, schema: dict = None) -> pd.DataFrame:
+    """
+    Returns raw records that were not read from a CSV (e.g. fetched from the API,
+    see fetch.py) typed according to the source's csv-schema like read_raw_data
+    """
+    schema = schema or {}
+    if schema.get("usecols"):
+        df = df[schema["usecols"]]
+    df = df.astype(schema_dtypes(schema))
+    return parse_dates(df, schema.get("dates", {}))
+
+
+def concat_chunks(chunks: list, ignore_index: bool = True) -> pd.DataFrame:
+    """
+    Concatenates the given DataFrame chunks, unioning the categories of
+    categorical columns (sorted, like those of a single read) so that they
+    stay categorical
+    """
+    if len(chunks) == 1:
+        return chunks[0]
+    for col in chunks[0].select_dtypes("category").columns:
+        categories = union_categoricals(
+            [chunk[col] for chunk in chunks], sort_categories=True
+        ).categories
+        for chunk in chunks:
+            chunk[col] = chunk[col].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=ignore_index)
+
+
+def ingest_raw_data(
+    paths: list,
+    schemas: list = None,
+    engine: str = None,
+    chunksizes: list = None,
+    definitions: list = None,
+) -> list:
+    """
+    Returns a DataFrame for each of the given paths, read with the schema and
+    chunksize at the same position, and cleaned chunk by chunk with the given
+    @param definitions
+    """
+    schemas = schemas or [None] * len(paths)
+    chunksizes = chunksizes or [None] * len(paths)
+    definitions = definitions or [None] * len(paths)
     data = []
-    for f in paths:
+    for f, schema, chunksize, definition in zip(
+        paths, schemas, chunksizes, definitions
+    ):
         try:
-            df = pd.read_csv(f, on_bad_lines="skip")
-            data.append(df)
-        except:
-            print(f"Missing {f}")
+            chunks = read_raw_data(f, schema, engine, chunksize)
+            if definition is None:
+                data.append(concat_chunks(list(chunks)))
+            else:
+                data.append(clean_chunks(chunks, definition))
+        except FileNotFoundError:
+            logging.error("Missing %s", f)
+            raise
     return data
 
 
+def extract_sources(config: dict, paths: dict) -> dict:
+    """
+    Reads and cleans the raw data of the given source tables, returning a
+    DataFrame for each table in @param paths (table name -> raw data path)
+    """
+    data = {}
+    for table, path in paths.items():
+        definition = config[table]
+        (data[table],) = instrument.call(
+            f"ingest/{table}",
+            ingest_raw_data,
+            [path],
+            [definition.get("csv-schema")],
+            config.get("csv-engine"),
+            [definition.get("csv-chunksize")],
+            [definition],
+        )
+    return data
+
+
+def clean_chunk(chunk: pd.DataFrame, definition: dict, start: int) -> pd.DataFrame:
+    """
+    Cleans a chunk of a source table (see clean_data) whose first row is row
+    @param start of the table, numbering its rows as in the whole table
+    """
+    chunk.index = pd.RangeIndex(start, start + len(chunk))
+    return clean_data(chunk, definition)
+
+
+def clean_chunks(chunks, definition: dict) -> pd.DataFrame:
+    """
+    Cleans the chunks of a source table one at a time as they are read and
+    returns them combined (see combine_chunks), so that only the cleaned and
+    compacted chunks are kept in memory
+    """
+    cleaned = []
+    start = 0
+    for chunk in chunks:
+        cleaned.append(clean_chunk(chunk, definition, start))
+        start += len(chunk)
+    return combine_chunks(cleaned, definition)
+
+
+def clean_batches(config: dict, batches, tables: list) -> dict:
+    """
+    Cleans the typed record batches of the given source tables (table -> batch,
+    e.g. one per page fetched from the API, see fetch.fetch_batches) as they
+    arrive and returns a DataFrame for each table (see clean_chunks)
+    """
+    cleaned = {table: [] for table in tables}
+    starts = dict.fromkeys(tables, 0)
+    for batch in batches:
+        for table in tables:
+            chunk = batch[table]
+            cleaned[table].append(clean_chunk(chunk, config[table], starts[table]))
+            starts[table] += len(chunk)
+    return {
+        table: combine_chunks(chunks, config[table])
+        for table, chunks in cleaned.items()
+    }
+
+
+def combine_chunks(chunks: list, definition: dict) -> pd.DataFrame:
+    """
+    Concatenates chunks of a source table cleaned on their own (see clean_data),
+    keeping their row labels, and removes the duplicates across chunks
+    """
+    df = concat_chunks(chunks, ignore_index=False)
+    if len(chunks) > 1 and "dupe-index" in definition:
+        df = remove_duplicates(df, definition["dupe-index"])
+    return df
+
+
+def partition_of(keys: pd.Series, partitions: int) -> np.ndarray:
+    """Returns the hash partition (0 to partitions - 1) of each key"""
+    return pd.util.hash_array(keys.to_numpy()) % partitions
+
+
+def spill_categories(chunk: pd.DataFrame, definition: dict) -> pd.DataFrame:
+    """
+    Returns the chunk with the raw columns that a source table compacts to
+    category (and does not convert) read as categories already, so that their
+    categories can be shared by every partition (see read_spill)
+    """
+    raw = {new: old for old, new in definition.get("rename", {}).items()}
+    conversion = definition.get("conversion", {})
+    columns = [
+        raw.get(col, col)
+        for col, dtype in definition.get("compact", {}).items()
+        if dtype == "category" and col not in conversion
+    ]
+    return chunk.astype(
+        {col: "category" for col in columns if chunk[col].dtype != "category"}
+    )
+
+
+def spill_chunk(
+    config: dict,
+    table: str,
+    chunk: pd.DataFrame,
+    number: int,
+    directory: str,
+    partitions: int,
+    empty: pd.DataFrame = None,
+) -> pd.DataFrame:
+    """
+    Hash-partitions a chunk on its partition-key into spill files under
+    @param directory. Returns no rows with the dtypes of the chunks so far
+    """
+    chunk = spill_categories(chunk, config[table])
+    parts = partition_of(chunk[config[table]["partition-key"]], partitions)
+    for part, rows in chunk.groupby(parts, sort=False):
+        folder = os.path.join(directory, table, str(part))
+        cache.store(folder, f"{number:08d}", rows.reset_index(drop=True))
+    return chunk.iloc[:0] if empty is None else concat_chunks([empty, chunk.iloc[:0]])
+
+
+def spill_source(config: dict, table: str, path: str, directory: str, partitions: int):
+    """
+    Streams the raw data of a source table in chunks of partitioned.chunksize
+    rows and spills each one (see spill_chunk), so that only one chunk is in
+    memory at a time
+    """
+    chunks = read_raw_data(
+        path,
+        config[table].get("csv-schema"),
+        chunksize=config["partitioned"]["chunksize"],
+    )
+    empty = None
+    for number, chunk in enumerate(chunks):
+        empty = spill_chunk(config, table, chunk, number, directory, partitions, empty)
+    store_empty(directory, table, empty)
+
+
+def spill_batches(config: dict, batches, tables: list, directory: str, partitions: int):
+    """
+    Spills the typed record batches of the given source tables (table -> batch,
+    e.g. one per page fetched from the API) as they arrive (see spill_chunk)
+    """
+    empty = dict.fromkeys(tables)
+    for number, batch in enumerate(batches):
+        for table in tables:
+            empty[table] = spill_chunk(
+                config, table, batch[table], number, directory, partitions, empty[table]
+            )
+    for table in tables:
+        store_empty(directory, table, empty[table])
+
+
+def store_empty(directory: str, table: str, empty: pd.DataFrame):
+    """
+    Stores the columns and dtypes of a spilled source table (see spill_chunk):
+    partitions without any rows still need them, and every partition shares
+    the categories of the whole table
+    """
+    if empty is None:
+        return
+    cache.store(os.path.join(directory, table), "empty", empty)
+    # Arrow does not keep the categories of columns without any rows
+    for col in empty.select_dtypes("category").columns:
+        categories = pd.DataFrame({col: empty[col].cat.categories})
+        cache.store(os.path.join(directory, table, "categories"), col, categories)
+
+
+def read_spill(directory: str, table: str, part: int) -> pd.DataFrame:
+    """
+    Returns the rows of one partition of a source table spilled by spill_source,
+    in the order they were read, with the categories of the whole table
+    """
+    df = cache.load(os.path.join(directory, table), "empty")
+    folder = os.path.join(directory, table, str(part))
+    if os.path.isdir(folder):
+        keys = sorted(os.path.splitext(name)[0] for name in os.listdir(folder))
+        df = concat_chunks([cache.load(folder, key) for key in keys])
+    for col in df.select_dtypes("category").columns:
+        categories = cache.load(os.path.join(directory, table, "categories"), col)
+        df[col] = df[col].cat.set_categories(categories[col].tolist())
+    return df
+
+
 # Transform
 def rename_cols(df: pd.DataFrame, cols: dict) -> pd.DataFrame:
     """Takes in a DataFrame and returns a copy with the columns renamed"""
@@ -34,7 +370,10 @@ def format_dates(df: pd.DataFrame, datecols: list) -> pd.DataFrame:
     formatted in YYYY-MM-DD format
     """
     for dt_ in datecols:
-        df[dt_] = pd.to_datetime(df[dt_]).dt.normalize()
+        # Columns typed by the csv-schema are already parsed
+        if not pd.api.types.is_datetime64_any_dtype(df[dt_]):
+            df[dt_] = pd.to_datetime(df[dt_])
+        df[dt_] = df[dt_].dt.normalize()
     return df
 
 
@@ -58,10 +397,27 @@ def convert_column(df: pd.DataFrame, config: dict) -> pd.DataFrame:
     return df
 
 
+def frame_mb(df: pd.DataFrame) -> float:
+    """Returns the memory used by the DataFrame in MiB"""
+    return df.memory_usage(deep=True).sum() / MB
+
+
+def compact_data(df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    """
+    Returns the DataFrame with its columns converted to the given compact dtypes
+    (e.g. category for low-cardinality text, nullable small ints like Int8,
+    boolean, float32), logging its memory before and after
+    """
+    before = frame_mb(df)
+    df = df.astype(dtypes)
+    logging.info("Compacted frame from %.1f MB to %.1f MB", before, frame_mb(df))
+    return df
+
+
 def clean_data(df: pd.DataFrame, config: dict) -> pd.DataFrame:
     """
-    Returns a DataFrame with duplicates removed and date
-    columns formatted as YYYY-MM-DD
+    Returns a DataFrame with duplicates removed, date columns formatted
+    as YYYY-MM-DD and columns compacted to the dtypes in `compact`
     """
     # Rename columns
     if "rename" in config:
@@ -73,8 +429,11 @@ def clean_data(df: pd.DataFrame, config: dict) -> pd.DataFrame:
     if "datecols" in config:
         df = format_dates(df, config["datecols"])
     # Drop duplicates
-    if "dupe_index" in config:
+    if "dupe-index" in config:
         df = remove_duplicates(df, config["dupe-index"])
+    # Compact dtypes
+    if "compact" in config:
+        df = compact_data(df, config["compact"])
     return df
 
 
@@ -110,6 +469,54 @@ def create_pivot_table(df: pd.DataFrame, config: dict, table: str) -> pd.DataFra
     return result
 
 
+def pivot_columns(pivot: np.ndarray, dtype, categories: list):
+    """
+    Returns the pivoted values (NaN where missing) as the data of the pivoted
+    columns, in the dtype of the source values when it can hold missing values
+    (floats and nullable dtypes like Int32), otherwise as float64 like pivot_table
+    """
+    if isinstance(dtype, np.dtype):
+        return pivot.astype(dtype if dtype.kind == "f" else "float64", copy=False)
+    # Nullable arrays are built from their values and missing masks directly
+    missing = np.isnan(pivot).T
+    data = np.where(missing, 0, pivot.T).astype(dtype.numpy_dtype)
+    array_type = dtype.construct_array_type()
+    return {
+        col: array_type(data[i], missing[i].copy()) for i, col in enumerate(categories)
+    }
+
+
+def create_pivot_tables(df: pd.DataFrame, config: dict, tables: list) -> list:
+    """
+    Returns the given pivot tables, built in a single pass over the DataFrame.
+    Matches create_pivot_table for tables sharing their index and pivot-on
+    """
+    definition = config[tables[0]]
+    categories = [col for col in definition["columns"] if isinstance(col, int)]
+    keys, index = pd.factorize(df[definition["index"]], sort=True)
+    slots = pd.Index(categories).get_indexer(df[definition["pivot-on"]])
+    keyed = keys >= 0
+    in_domain = keyed & (slots >= 0)
+    results = []
+    for table in tables:
+        column = df[config[table]["values"]]
+        values = column.to_numpy(dtype="float64", na_value=np.nan)
+        pivot = np.full((len(index), len(categories)), np.nan)
+        pivot[keys[in_domain], slots[in_domain]] = values[in_domain]
+        # Like pivot_table, drop index values without any non-missing value
+        present = np.zeros(len(index), dtype=bool)
+        present[keys[keyed & ~np.isnan(values)]] = True
+        result = pd.DataFrame(
+            pivot_columns(pivot[present], column.dtype, categories),
+            index=pd.Index(index[present], name="id"),
+            columns=pd.Index(categories, name=config[table]["pivot-on"]),
+        )
+        result.insert(0, "anime_id", result.index)
+        result.insert(1, "load_date", config[table]["load-date"])
+        results.append(result[config[table]["columns"]])
+    return results
+
+
 def join_data(
     config: dict, df1: pd.DataFrame, df2: pd.DataFrame, df3: pd.DataFrame
 ) -> pd.DataFrame:
@@ -128,6 +535,209 @@ def join_data(
     return results
 
 
+def plan_joins(config: dict, tables: list, frames: dict) -> dict:
+    """
+    Returns a plan building the given join tables from a shared base of the
+    inputs they all join on
+    """
+    key = config["anime-stats-scores"]["primarykey"]
+    columns = config["anime-stats-scores"]["columns"]
+    inputs = {table: config[table]["inputs"] for table in tables}
+    shared = [
+        name
+        for name in inputs[tables[0]]
+        if all(name in names for names in inputs.values())
+    ]
+    projections = {}
+    for names in inputs.values():
+        provided = set()
+        for name in names:
+            projection = [
+                col
+                for col in columns
+                if col != key and col in frames[name].columns and col not in provided
+            ]
+            provided.update(projection)
+            projections.setdefault(name, [key] + projection)
+    return {
+        "key": key,
+        "columns": columns,
+        "shared": shared,
+        "own": {
+            table: [name for name in names if name not in shared]
+            for table, names in inputs.items()
+        },
+        "projections": projections,
+    }
+
+
+def attach(df: pd.DataFrame, other: pd.DataFrame, key: str) -> pd.DataFrame:
+    """
+    Returns the inner join of the DataFrame with another one that is indexed by
+    the unique join key, keeping the DataFrame's row order. The other DataFrame's
+    rows are aligned by index lookup rather than with a hash merge.
+    """
+    df = df[df[key].isin(other.index)]
+    aligned = other.reindex(df[key])
+    return pd.concat(
+        [df.reset_index(drop=True), aligned.reset_index(drop=True)], axis=1
+    )
+
+
+def join_tables(config: dict, frames: dict, tables: list) -> dict:
+    """
+    Returns the given join tables, built from the DataFrames in @param frames
+    (keyed by table name) according to plan_joins. The output is identical to
+    join_data on the same inputs.
+    """
+    plan = plan_joins(config, tables, frames)
+    key = plan["key"]
+
+    def project(name):
+        projected = frames[name][plan["projections"][name]]
+        return projected.set_index(key)
+
+    base = frames[plan["shared"][0]][plan["projections"][plan["shared"][0]]]
+    for name in plan["shared"][1:]:
+        base = attach(base, project(name), key)
+    results = {}
+    for table in tables:
+        result = base
+        for name in plan["own"][table]:
+            result = attach(result, project(name), key)
+        results[table] = result[plan["columns"]]
+    return results
+
+
+def quote(col) -> str:
+    """Returns the column name quoted as a Postgres identifier"""
+    return f'"{col}"'
+
+
+def day_key_columns(definition: dict, columns: dict) -> tuple:
+    """
+    Returns the SELECT list of the given columns (name -> expression) of a table
+    built in the database, with the <column>_key of each of its day-keys next
+    to it like add_day_keys, and the joins to dim_day those keys come from
+    """
+    select = []
+    joins = []
+    for col, expression in columns.items():
+        select.append(
+            expression if expression == quote(col) else f"{expression} AS {quote(col)}"
+        )
+        if col in definition.get("day-keys", []):
+            alias = f"d{len(joins)}"
+            select.append(sql.DAY_KEY_COLUMN.format(alias=alias, key=f"{col}_key"))
+            joins.append(sql.DAY_KEY_JOIN.format(alias=alias, column=expression))
+    return "\n        ,".join(select), "\n    ".join(joins)
+
+
+def pivot_types(config: dict, table: str) -> tuple:
+    """
+    Returns the Postgres types of the index and of the pivoted columns of the
+    given pivot table, the ones create_pivot_tables gives them from the input
+    table's compact (or raw) dtypes, so both transforms create the same table
+    """
+    definition = config[table]
+    source = config[definition["inputs"][0]]
+    rename = source.get("rename", {})
+    dtypes = source["csv-schema"]["dtypes"]
+    dtypes = {rename.get(col, col): dtype for col, dtype in dtypes.items()}
+    dtypes.update(source.get("compact", {}))
+    index = pd.api.types.pandas_dtype(dtypes[definition["index"]])
+    values = pd.api.types.pandas_dtype(dtypes[definition["values"]])
+    # Like pivot_columns, missing values turn non-nullable integers into floats
+    if isinstance(values, np.dtype) and values.kind != "f":
+        values = np.dtype("float64")
+    return tuple(
+        sql_type(dtype)().compile(dialect=postgresql.dialect())
+        for dtype in (index, values)
+    )
+
+
+def pivot_sql(config: dict, table: str) -> str:
+    """
+    Returns the SQL that builds the given pivot table inside the database from
+    its input table with crosstab(). The pivoted categories are the integer
+    columns of the table's configured columns.
+    """
+    definition = config[table]
+    source = config[definition["inputs"][0]]
+    categories = [col for col in definition["columns"] if isinstance(col, int)]
+    index = definition["index"]
+    columns = {
+        index: f"ct.{index}",
+        "load_date": f"'{definition['load-date']}'::DATE",
+        **{col: quote(col) for col in categories},
+    }
+    select, day_joins = day_key_columns(definition, columns)
+    index_type, value_type = pivot_types(config, table)
+    return sql.CREATE_PIVOT_TABLE.format(
+        unlogged="UNLOGGED " if definition.get("unlogged") else "",
+        schema=definition["schema"],
+        tablename=definition["tablename"],
+        columns=select,
+        day_joins=day_joins,
+        index=index,
+        index_type=index_type,
+        pivot_on=definition["pivot-on"],
+        values=definition["values"],
+        source=f"{source['schema']}.{source['tablename']}",
+        categories=", ".join(f"({col})" for col in categories),
+        value_types=", ".join(f"{quote(col)} {value_type}" for col in categories),
+    )
+
+
+def join_sql(config: dict, table: str) -> str:
+    """
+    Returns the SQL that builds the given joined table inside the database as the
+    inner join of its input tables, in the same way as join_data
+    """
+    definition = config[table]
+    key = config["anime-stats-scores"]["primarykey"]
+    inputs = [config[name] for name in definition["inputs"]]
+    names = [f"{source['schema']}.{source['tablename']}" for source in inputs]
+    columns = {
+        # The load date comes from the first input, like load_date_x in join_data
+        col: "t0.load_date" if col == "load_date" else quote(col)
+        for col in config["anime-stats-scores"]["columns"]
+    }
+    select, day_joins = day_key_columns(definition, columns)
+    return sql.CREATE_JOINED_TABLE.format(
+        unlogged="UNLOGGED " if definition.get("unlogged") else "",
+        schema=definition["schema"],
+        tablename=definition["tablename"],
+        columns=select,
+        day_joins=day_joins,
+        base=names[0],
+        joins="\n    ".join(
+            f"INNER JOIN {name} AS t{i} USING ({key})"
+            for i, name in enumerate(names[1:], start=1)
+        ),
+    )
+
+
+def transform_in_database(config: dict, tables: list, engine):
+    """
+    Builds the given derived tables inside the database from the already loaded
+    base tables, in the given order, instead of transforming them in pandas
+    """
+    with engine.connect() as conn:
+        for table in tables:
+            instrument.call(
+                f"transform-in-db/{table}", build_in_database, conn, config, table
+            )
+
+
+def build_in_database(conn, config: dict, table: str):
+    """Builds a derived table inside the database, with its day keys"""
+    builders = {"pivot": pivot_sql, "join": join_sql}
+    with conn.begin():
+        query = builders[config[table]["transform"]](config, table)
+        execute_sql(conn, [sql.SET_UTC_TIME_ZONE, query])
+
+
 # Load
 def execute_sql(conn, queries: list):
     """Executes the given queries on the provided connection"""
@@ -135,28 +745,841 @@ def execute_sql(conn, queries: list):
         conn.execute(query)
 
 
-def load_data_sync(data: dict, config: dict, engine):
+def metadata_sql(config: dict, tables: list) -> str:
+    """Returns the sql.METADATA of the given tables, e.g. for a partial refresh"""
+    return "".join(
+        sql.METADATA.get(f"{config[table]['schema']}.{config[table]['tablename']}", "")
+        for table in tables
+    )
+
+
+def sql_type(dtype):
+    """
+    Returns the SQLAlchemy type of a column with the given pandas dtype, looking
+    through categoricals to their categories and nullable dtypes to their numpy
+    type. None leaves the choice to pandas (text, dates...).
+    """
+    if isinstance(dtype, pd.CategoricalDtype):
+        return sql_type(dtype.categories.dtype)
+    dtype = getattr(dtype, "numpy_dtype", dtype)
+    if not isinstance(dtype, np.dtype):
+        return None
+    return SQL_TYPES.get((dtype.kind, dtype.itemsize))
+
+
+def sql_types(df: pd.DataFrame) -> dict:
+    """
+    Returns the Postgres column types of the DataFrame's compact dtypes (SMALLINT
+    for Int8, REAL for float32...) to create its table with
+    """
+    columns = {}
+    for col, dtype in df.dtypes.items():
+        column_type = sql_type(dtype)
+        if column_type is not None:
+            columns[col] = column_type
+    return columns
+
+
+def table_schema(
+    df: pd.DataFrame, tablename: str, schema: str, engine, unlogged: bool = False
+) -> str:
+    """
+    Returns the CREATE TABLE statement for the DataFrame (see sql_types), of an
+    UNLOGGED table with @param unlogged
+    """
+    create = pd.io.sql.get_schema(
+        df, tablename, con=engine, schema=schema, dtype=sql_types(df)
+    )
+    if unlogged:
+        create = create.replace("CREATE TABLE", "CREATE UNLOGGED TABLE", 1)
+    return create
+
+
+def copy_frame(cursor, df: pd.DataFrame, tablename: str, schema: str, chunksize: int):
+    """
+    Streams the given DataFrame into an existing table with COPY ... FROM STDIN,
+    serializing at most `chunksize` rows into an in-memory CSV buffer at a time
+    """
+    columns = ", ".join(f'"{col}"' for col in df.columns)
+    query = (
+        f'COPY "{schema}"."{tablename}" ({columns}) '
+        f"FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+    )
+    for start in range(0, len(df), chunksize):
+        buffer = StringIO()
+        df.iloc[start : start + chunksize].to_csv(
+            buffer, index=False, header=False, na_rep=COPY_NULL
+        )
+        buffer.seek(0)
+        cursor.copy_expert(query, buffer)
+
+
+def copy_db(
+    df: pd.DataFrame,
+    tablename: str,
+    schema: str,
+    engine,
+    if_exists: str = "replace",
+    chunksize: int = 100000,
+    unlogged: bool = False,
+):
+    """
+    Loads the given DataFrame into the database with Postgres' COPY protocol
+    instead of row-by-row INSERTs. The table is (re)created from the DataFrame's
+    dtypes (as an UNLOGGED table with @param unlogged) and filled in the same
+    transaction.
+    """
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        if if_exists == "replace":
+            cursor.execute(f'DROP TABLE IF EXISTS "{schema}"."{tablename}"')
+        if if_exists in ("replace", "fail"):
+            cursor.execute(table_schema(df, tablename, schema, engine, unlogged))
+        copy_frame(cursor, df, tablename, schema, chunksize)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def row_hashes(df: pd.DataFrame, ignore: list = None) -> pd.Series:
+    """
+    Returns a 64-bit hash of each row's content, leaving out the given columns
+    (e.g. load_date, which changes on every run) and their day keys
+    """
+    ignore = list(ignore or [])
+    ignore += [f"{col}_key" for col in ignore]
+    content = df.drop(columns=[col for col in ignore if col in df.columns])
+    hashes = pd.util.hash_pandas_object(content, index=False)
+    # Postgres has no unsigned 64-bit type, so store the bits as a BIGINT
+    return pd.Series(hashes.values.view("int64"), index=df.index)
+
+
+def table_columns(cursor, tablename: str, schema: str) -> list:
+    """Returns the column names of the given table, or an empty list if it does not exist"""
+    cursor.execute(
+        """
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s
+        ORDER BY ordinal_position
+        """,
+        (schema, tablename),
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def changed_rows(cursor, df: pd.DataFrame, tablename: str, schema: str, keys: list):
+    """
+    Returns the rows of the given DataFrame (which must carry a row_hash column)
+    that are new or whose content differs from what is stored in the table
+    """
+    columns = ", ".join(f'"{col}"' for col in keys + ["row_hash"])
+    cursor.execute(f'SELECT {columns} FROM "{schema}"."{tablename}"')
+    stored = pd.DataFrame(cursor.fetchall(), columns=keys + ["row_hash"])
+    stored = stored.astype(df[keys + ["row_hash"]].dtypes.to_dict())
+    matches = df[keys + ["row_hash"]].merge(
+        stored, how="left", on=keys + ["row_hash"], indicator=True
+    )
+    return df[(matches["_merge"] == "left_only").to_numpy()]
+
+
+def upsert_db(
+    df: pd.DataFrame,
+    tablename: str,
+    schema: str,
+    keys: list,
+    engine,
+    ignore: list = None,
+    chunksize: int = 100000,
+) -> int:
+    """
+    Incrementally loads the given DataFrame into the table, merging on the given
+    keys. Only rows that are new or whose content changed since the last load are
+    sent to the database, where they are applied with INSERT ... ON CONFLICT UPDATE.
+    Rows that disappeared from the source are kept. Returns the number of rows written.
+    """
+    df = df.assign(row_hash=row_hashes(df, ignore))
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        key_list = ", ".join(f'"{col}"' for col in keys)
+        if table_columns(cursor, tablename, schema) != list(map(str, df.columns)):
+            # First incremental load (or a table from a full load, or with other
+            # columns): start over
+            cursor.execute(f'DROP TABLE IF EXISTS "{schema}"."{tablename}"')
+            cursor.execute(table_schema(df, tablename, schema, engine))
+            cursor.execute(
+                f'CREATE UNIQUE INDEX "{tablename}_merge_key" '
+                f'ON "{schema}"."{tablename}" ({key_list})'
+            )
+            changed = df
+        else:
+            changed = changed_rows(cursor, df, tablename, schema, keys)
+        if len(changed):
+            staging = f"{tablename}_changes"
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE "{staging}" '
+                f'(LIKE "{schema}"."{tablename}") ON COMMIT DROP'
+            )
+            copy_frame(cursor, changed, staging, "pg_temp", chunksize)
+            columns = ", ".join(f'"{col}"' for col in changed.columns)
+            updates = ", ".join(
+                f'"{col}" = EXCLUDED."{col}"'
+                for col in changed.columns
+                if col not in keys
+            )
+            cursor.execute(
+                f'INSERT INTO "{schema}"."{tablename}" ({columns}) '
+                f'SELECT {columns} FROM "pg_temp"."{staging}" '
+                f"ON CONFLICT ({key_list}) DO UPDATE SET {updates}"
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return len(changed)
+
+
+@lru_cache(maxsize=None)
+def dim_day_keys(engine) -> tuple:
+    """
+    Returns the dates of public.dim_day (as a DatetimeIndex), their day_keys and
+    the day_key of its NULL row. Cached per engine until dim_day changes (see
+    dimensions.ensure_dim_day).
+    """
+    days = pd.read_sql(sql.SELECT_DIM_DAY_KEYS, engine)
+    null_key = pd.read_sql(sql.SELECT_DIM_DAY_NULL_KEY, engine)["day_key"].iloc[0]
+    return pd.DatetimeIndex(days["_date"]), days["day_key"].to_numpy(), null_key
+
+
+def add_day_keys(df: pd.DataFrame, columns: list, engine) -> pd.DataFrame:
+    """
+    Returns the DataFrame with the dim_day day_key of each of the given date
+    columns in a <column>_key column next to it, so that joins to dim_day are
+    integer joins. Missing dates (and dates outside dim_day) get its NULL row.
+    """
+    dates, keys, null_key = dim_day_keys(engine)
+    day_keys = {}
+    for col in columns:
+        values = pd.to_datetime(df[col])
+        if values.dt.tz is not None:
+            values = values.dt.tz_convert(None)
+        positions = dates.get_indexer(values.dt.normalize())
+        outside = (positions < 0) & values.notna().to_numpy()
+        if outside.any():
+            logging.warning("%s dates in %s are outside dim_day", outside.sum(), col)
+        day_keys[f"{col}_key"] = pd.array(
+            np.where(positions >= 0, keys[positions], null_key), dtype="Int32"
+        )
+    order = []
+    for col in df.columns:
+        order.append(col)
+        if f"{col}_key" in day_keys:
+            order.append(f"{col}_key")
+    return df.assign(**day_keys)[order]
+
+
+def with_day_keys(df: pd.DataFrame, table: str, config: dict, engine) -> pd.DataFrame:
+    """Returns the DataFrame with the day keys of the given table (see add_day_keys)"""
+    if "day-keys" not in config[table]:
+        return df
+    return add_day_keys(df, config[table]["day-keys"], engine)
+
+
+def index_sql(config: dict, table: str, tablename: str = None) -> list:
+    """
+    Returns the statements that create the keys and indexes of a table, or of
+    the given table with the same columns (e.g. a partition being staged). The
+    keys of history tables include the column they are partitioned on.
+    """
+    definition = config[table]
+    tablename = tablename or definition["tablename"]
+    names = {"schema": definition["schema"], "tablename": tablename}
+    keys = definition.get("keys", {})
+    column = history_column(config, table)
+    partitioned = [column] if column else []
+    queries = []
+    if "primary" in keys:
+        queries.append(
+            sql.ADD_PRIMARY_KEY.format(
+                name=f"{tablename}_pkey",
+                columns=", ".join(
+                    quote(col) for col in with_columns(keys["primary"], partitioned)
+                ),
+                **names,
+            )
+        )
+    indexes = [
+        ("UNIQUE ", with_columns(columns, partitioned))
+        for columns in keys.get("unique", [])
+    ]
+    indexes += [("", columns) for columns in definition.get("indexes", [])]
+    for unique, columns in indexes:
+        queries.append(
+            sql.CREATE_INDEX.format(
+                unique=unique,
+                name="_".join([tablename, *map(str, columns), "idx"]),
+                columns=", ".join(quote(col) for col in columns),
+                **names,
+            )
+        )
+    return queries
+
+
+def with_columns(columns: list, extra: list) -> list:
+    """Returns the columns followed by those of @param extra they do not include"""
+    return list(columns) + [col for col in extra if col not in columns]
+
+
+def build_table_indexes(engine, queries: list, memory: str) -> int:
+    """
+    Runs the given index statements in one transaction on their own connection,
+    with the session's maintenance_work_mem raised to @param memory
+    """
+    with engine.connect() as conn:
+        with conn.begin():
+            execute_sql(conn, [sql.SET_MAINTENANCE_WORK_MEM.format(memory=memory)])
+            execute_sql(conn, queries)
+    return len(queries)
+
+
+def build_indexes(config: dict, tables: list, engine):
+    """
+    Creates the keys and indexes declared for the given tables after they are
+    loaded, in parallel (see run_table_queries)
+    """
+    queries = {table: index_sql(config, table) for table in tables}
+    run_table_queries(config, queries, engine, "index")
+
+
+def run_table_queries(config: dict, queries: dict, engine, stage: str):
+    """
+    Runs the statements of each table (table -> queries) as the stage
+    <stage>/<table>, in parallel on as many connections as the engine's pool
+    has (up to scheduler.max-connections) and with indexing.maintenance-work-mem
+    (see build_table_indexes)
+    """
+    workers = pool_workers(engine, config["scheduler"]["max-connections"])
+    memory = config["indexing"]["maintenance-work-mem"]
+    futures = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for table, table_queries in queries.items():
+            if table_queries:
+                future = executor.submit(
+                    instrument.call,
+                    f"{stage}/{table}",
+                    build_table_indexes,
+                    engine,
+                    table_queries,
+                    memory,
+                )
+                futures[future] = table
+        for future in as_completed(futures):
+            future.result()
+
+
+def create_table(
+    df: pd.DataFrame, tablename: str, schema: str, engine, unlogged: bool = False
+):
+    """(Re)creates an empty table with the columns and types of the DataFrame"""
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f'DROP TABLE IF EXISTS "{schema}"."{tablename}"')
+        cursor.execute(table_schema(df, tablename, schema, engine, unlogged))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def load_table(
+    df: pd.DataFrame, table: str, config: dict, engine, incremental: bool = False
+) -> int:
+    """
+    Loads the DataFrame into the database with the loader configured for the table.
+    In incremental mode, tables with a dupe-index are upserted on those keys instead
+    of being replaced. In history mode, history tables get a new partition instead
+    (see load_history). Returns the number of rows written.
+    """
+    if history_column(config, table):
+        return load_history(df, table, config, engine)
+    tablename = config[table]["tablename"]
+    schema = config[table]["schema"]
+    chunksize = config[table].get("copy-chunksize", 100000)
+    df = with_day_keys(df, table, config, engine)
+    if incremental and "dupe-index" in config[table]:
+        ignore = config.get("incremental", {}).get("ignore-columns")
+        rows = upsert_db(
+            df,
+            tablename,
+            schema,
+            config[table]["dupe-index"],
+            engine,
+            ignore=ignore,
+            chunksize=chunksize,
+        )
+        logging.info("Upserted %s changed rows into %s.%s", rows, schema, tablename)
+        return rows
+    unlogged = config[table].get("unlogged", False)
+    if config[table].get("loader", "insert") == "copy":
+        copy_db(df, tablename, schema, engine, chunksize=chunksize, unlogged=unlogged)
+    elif unlogged:
+        # pandas cannot create unlogged tables, so insert into one created first
+        create_table(df, tablename, schema, engine, unlogged=True)
+        insert_db(df, tablename, schema, engine=engine, if_exists="append")
+    else:
+        insert_db(df, tablename, schema, engine=engine, if_exists="replace")
+    return len(df)
+
+
+def append_table(df: pd.DataFrame, table: str, config: dict, engine) -> int:
+    """
+    Appends the DataFrame to the existing table with the loader configured for it.
+    Returns the number of rows written.
+    """
+    tablename = config[table]["tablename"]
+    schema = config[table]["schema"]
+    df = with_day_keys(df, table, config, engine)
+    if config[table].get("loader", "insert") == "copy":
+        chunksize = config[table].get("copy-chunksize", 100000)
+        copy_db(df, tablename, schema, engine, if_exists="append", chunksize=chunksize)
+    else:
+        insert_db(df, tablename, schema, engine=engine, if_exists="append")
+    return len(df)
+
+
+def history_column(config: dict, table: str):
+    """
+    Returns the column the table's history is range-partitioned on, or None if
+    history mode is off or the table declares no history-column
+    """
+    if not config["history"]["enabled"]:
+        return None
+    return config[table].get("history-column")
+
+
+def relation_kind(cursor, tablename: str, schema: str):
+    """Returns the pg_class relkind of the given table, None if it does not exist"""
+    cursor.execute(sql.SELECT_RELATION_KIND, (schema, tablename))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def create_history_table(
+    cursor, df: pd.DataFrame, tablename: str, schema: str, column: str, engine
+):
+    """
+    Creates the table range-partitioned on @param column unless it exists,
+    replacing a table that is not partitioned
+    """
+    kind = relation_kind(cursor, tablename, schema)
+    if kind == "p":
+        columns = table_columns(cursor, tablename, schema)
+        if columns != list(map(str, df.columns)):
+            raise ValueError(
+                f"The columns of {schema}.{tablename} changed from {columns}, "
+                "rename or drop its history to load the new columns"
+            )
+        return
+    if kind is not None:
+        logging.warning("Replacing %s.%s with a history table", schema, tablename)
+        cursor.execute(f'DROP TABLE "{schema}"."{tablename}"')
+    create = table_schema(df, tablename, schema, engine).rstrip()
+    cursor.execute(create + sql.PARTITION_BY_RANGE.format(column=quote(column)))
+
+
+def load_history(df: pd.DataFrame, table: str, config: dict, engine) -> int:
+    """
+    Loads the DataFrame into the history table of the given table, replacing
+    the partition of each day it holds. Returns the number of rows written
+    """
+    definition = config[table]
+    tablename = definition["tablename"]
+    schema = definition["schema"]
+    column = definition["history-column"]
+    chunksize = definition.get("copy-chunksize", 100000)
+    memory = config["indexing"]["maintenance-work-mem"]
+    df = with_day_keys(df, table, config, engine)
+    days = pd.to_datetime(df[column]).dt.normalize()
+    if days.isna().any():
+        logging.warning(
+            "Skipping %s rows of %s without a %s", days.isna().sum(), table, column
+        )
+    rows = 0
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        create_history_table(cursor, df, tablename, schema, column, engine)
+        conn.commit()
+        for day, part in df.groupby(days.to_numpy(), sort=True):
+            day = pd.Timestamp(day)
+            names = {
+                "schema": schema,
+                "tablename": tablename,
+                "column": quote(column),
+                "partition": f"{tablename}_{day:%Y%m%d}",
+                "stage": f"{tablename}_{day:%Y%m%d}_new",
+                "start": f"{day:%Y-%m-%d}",
+                "end": f"{day + pd.Timedelta(days=1):%Y-%m-%d}",
+            }
+            cursor.execute(sql.CREATE_PARTITION_STAGE.format(**names))
+            copy_frame(cursor, part, names["stage"], schema, chunksize)
+            cursor.execute(sql.SET_MAINTENANCE_WORK_MEM.format(memory=memory))
+            for query in index_sql(config, table, names["stage"]):
+                cursor.execute(query)
+            cursor.execute(sql.ATTACH_PARTITION.format(**names))
+            conn.commit()
+            rows += len(part)
+            logging.info(
+                "Attached %s rows to %s.%s as %s",
+                len(part),
+                schema,
+                tablename,
+                names["partition"],
+            )
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return rows
+
+
+def expire_history(config: dict, tables: list, engine) -> int:
+    """
+    Applies the retention policy of history mode to the given tables: the
+    partitions of days at least history.retention-days older than the newest
+    one are detached, and dropped as well with history.drop-detached. Returns
+    the number of partitions detached.
+    """
+    options = config["history"]
+    if not options.get("retention-days"):
+        return 0
+    retention = pd.Timedelta(days=options["retention-days"])
+    expired = 0
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        for table in tables:
+            if not history_column(config, table):
+                continue
+            names = {
+                "schema": config[table]["schema"],
+                "tablename": config[table]["tablename"],
+            }
+            days = history_partitions(cursor, **names)
+            if not days:
+                continue
+            cutoff = max(days.values()) - retention
+            for partition, day in days.items():
+                if day > cutoff:
+                    continue
+                cursor.execute(
+                    sql.DETACH_PARTITION.format(partition=partition, **names)
+                )
+                if options.get("drop-detached"):
+                    cursor.execute(
+                        sql.DROP_PARTITION.format(partition=partition, **names)
+                    )
+                conn.commit()
+                expired += 1
+                logging.info("Detached partition %s of %s", partition, table)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return expired
+
+
+def history_partitions(cursor, tablename: str, schema: str) -> dict:
+    """Returns the day of each partition of a history table (see load_history)"""
+    cursor.execute(sql.SELECT_PARTITIONS, (schema, tablename))
+    days = {}
+    for (partition,) in cursor.fetchall():
+        suffix = partition[len(tablename) + 1 :]
+        if partition.startswith(f"{tablename}_") and suffix.isdigit():
+            days[partition] = pd.Timestamp(suffix)
+    return days
+
+
+def staged_config(config: dict, tables: list) -> dict:
+    """
+    Returns a copy of the configuration in which the given tables are loaded
+    as unlogged tables into the staged.schema scratch schema (see swap_staged).
+    History tables keep their schema, as their partitions are already attached
+    atomically.
+    """
+    staged = copy.deepcopy(config)
+    for table in tables:
+        if not history_column(config, table):
+            staged[table]["schema"] = config["staged"]["schema"]
+            staged[table]["unlogged"] = True
+    return staged
+
+
+def set_logged(config: dict, tables: list, engine):
+    """Makes the given unlogged tables logged, in parallel (see run_table_queries)"""
+    queries = {
+        table: [
+            sql.SET_LOGGED.format(
+                schema=config[table]["schema"], tablename=config[table]["tablename"]
+            )
+        ]
+        for table in tables
+        if config[table].get("unlogged")
+    }
+    run_table_queries(config, queries, engine, "logged")
+
+
+def swap_staged(config: dict, staged: dict, tables: list, engine, metadata: str):
+    """
+    Moves the given tables from the scratch schema into their live schemas
+    with their @param metadata, in one transaction. Fails if views depend on
+    them
+    """
+    options = config["staged"]
+    queries = [sql.SET_LOCK_TIMEOUT.format(timeout=options["lock-timeout"])]
+    swapped = []
+    for table in tables:
+        if staged[table]["schema"] != config[table]["schema"]:
+            swapped.append(f"{config[table]['schema']}.{config[table]['tablename']}")
+            queries.append(
+                sql.SWAP_TABLE.format(
+                    schema=config[table]["schema"],
+                    staging=staged[table]["schema"],
+                    tablename=config[table]["tablename"],
+                )
+            )
+    if metadata:
+        queries.append(metadata)
+    with engine.connect() as conn:
+        with conn.begin():
+            views = conn.execute(
+                text(sql.SELECT_DEPENDENT_VIEWS), {"tables": swapped}
+            ).fetchall()
+            if views:
+                raise RuntimeError(
+                    "Staged tables cannot replace tables that views depend on: "
+                    + ", ".join(f"{row.view_name} ({row.table_name})" for row in views)
+                )
+            execute_sql(conn, queries)
+        execute_sql(conn, [sql.DROP_STAGING_SCHEMA.format(schema=options["schema"])])
+
+
+def pool_workers(engine, limit: int = None) -> int:
+    """
+    Returns how many loads can run at once without waiting on the engine's
+    connection pool, capped at the given limit
+    """
+    pool = engine.pool
+    if not hasattr(pool, "size"):
+        return limit or 1
+    # Overflow connections are closed as soon as they are returned, so only the
+    # pool's persistent connections are counted on
+    workers = pool.size()
+    return min(workers, limit) if limit else workers
+
+
+def submit_load(
+    executor, df: pd.DataFrame, table: str, config: dict, engine, incremental=False
+) -> list:
+    """
+    Submits the load of a table to the executor and returns its futures, large
+    frames split into row ranges (see finish_ranges)
+    """
+    partition_rows = config["scheduler"].get("partition-rows")
+    upsert = incremental and "dupe-index" in config[table]
+    # History tables are loaded a day's partition at a time instead
+    if upsert or history_column(config, table):
+        partition_rows = None
+    if not partition_rows or len(df) <= partition_rows:
+        return [
+            executor.submit(
+                instrument.call,
+                f"load/{table}",
+                load_table,
+                df,
+                table,
+                config,
+                engine,
+                incremental,
+            )
+        ]
+    definition = config[table]
+    scratch = dict(
+        config, **{table: dict(definition, tablename=scratch_name(table, config))}
+    )
+    # The partitions get their day keys when they are appended
+    sample = with_day_keys(df.iloc[:partition_rows], table, config, engine)
+    instrument.call(
+        f"create/{table}",
+        create_table,
+        sample,
+        scratch[table]["tablename"],
+        definition["schema"],
+        engine,
+        definition.get("unlogged", False),
+    )
+    ranges = [
+        executor.submit(
+            instrument.call,
+            f"load/{table}/{part}",
+            append_table,
+            df.iloc[start : start + partition_rows],
+            table,
+            scratch,
+            engine,
+        )
+        for part, start in enumerate(range(0, len(df), partition_rows))
+    ]
+    return [finish_ranges(ranges, table, config, engine)]
+
+
+def scratch_name(table: str, config: dict) -> str:
+    """Returns the name of the scratch table the row ranges of a table are loaded into"""
+    return f"{config[table]['tablename']}_ranges"
+
+
+def finish_ranges(futures: list, table: str, config: dict, engine) -> Future:
+    """
+    Returns a future of the rows of a table loaded by the given row-range loads
+    into its scratch table, done once they all finished: the scratch table then
+    replaces the table, or is dropped if any range failed so that the table is
+    never left partly loaded (and the future fails with the range's error)
+    """
+    result = Future()
+    lock = threading.Lock()
+    pending = [len(futures)]
+    names = {
+        "schema": config[table]["schema"],
+        "tablename": config[table]["tablename"],
+        "scratch": scratch_name(table, config),
+    }
+
+    def finished(_):
+        with lock:
+            pending[0] -= 1
+            if pending[0]:
+                return
+        errors = [future.exception() for future in futures if future.exception()]
+        query = sql.DROP_LOADED_TABLE if errors else sql.RENAME_LOADED_TABLE
+        try:
+            with engine.connect() as conn:
+                with conn.begin():
+                    execute_sql(conn, [query.format(**names)])
+        except Exception as err:  # pylint: disable=broad-except
+            errors.append(err)
+        if errors:
+            result.set_exception(errors[0])
+        else:
+            result.set_result(sum(future.result() for future in futures))
+
+    for future in futures:
+        future.add_done_callback(finished)
+    return result
+
+
+def collect_loads(futures: dict) -> dict:
+    """
+    Waits for the given load futures (future -> table) and returns the number of
+    rows loaded into each table. Every failure is logged, and a LoadError with the
+    error of each failed table (and the rows of the others) is raised once all
+    loads have finished.
+    """
+    rows = {}
+    errors = {}
+    for future in as_completed(futures):
+        table = futures[future]
+        try:
+            rows[table] = rows.get(table, 0) + future.result()
+        except Exception as err:  # pylint: disable=broad-except
+            logging.exception("Failed to load %s", table)
+            errors.setdefault(table, err)
+    for table, count in rows.items():
+        if table not in errors:
+            logging.info("Loaded %s rows into %s", count, table)
+    if errors:
+        loaded = {table: count for table, count in rows.items() if table not in errors}
+        raise LoadError(errors, loaded)
+    return rows
+
+
+def load_data_sync(data: dict, config: dict, engine, incremental: bool = False):
     """Synchronously oads data into the database based on the provided config"""
     for df in data:
-        insert_db(
-            data[df],
-            config[df]["tablename"],
-            config[df]["schema"],
-            engine=engine,
-            if_exists="replace",
-        )
+        load_table(data[df], df, config, engine, incremental)
 
 
-def load_data_single(data: tuple, engine, config):
+def load_data_single(data: tuple, engine, config, incremental: bool = False):
     """Helper function to unpack and load data into database"""
     # unpack data
     table, df = data
-    tablename = config[table]["tablename"]
-    schema = config[table]["schema"]
-    insert_db(df, tablename, schema, engine=engine, if_exists="replace")
+    return load_table(df, table, config, engine, incremental)
 
 
-def load_data_concurrent(config: dict, data: list, engine):
-    """Concurrently loads data into the database based on provided config"""
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        executor.map(lambda p: load_data_single(p, engine, config), data.items())
+def load_data_concurrent(
+    config: dict, data: dict, engine, incremental: bool = False
+) -> dict:
+    """
+    Concurrently loads data into the database based on provided config. Returns
+    the rows loaded per table and raises a LoadError if any table failed
+    """
+    workers = pool_workers(engine, config["scheduler"]["max-connections"])
+    order = sorted(
+        data,
+        key=lambda table: data[table].memory_usage(index=False).sum(),
+        reverse=True,
+    )
+    futures = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for table in order:
+            for future in submit_load(
+                executor, data[table], table, config, engine, incremental
+            ):
+                futures[future] = table
+        return collect_loads(futures)
+
+
+def export_table(
+    df: pd.DataFrame, table: str, config: dict, engine, part: int = 0
+) -> int:
+    """
+    Exports the DataFrame of a table with the day keys it is loaded with (see
+    export.write_table). Returns the rows written.
+    """
+    return export.write_table(
+        with_day_keys(df, table, config, engine), table, config, part
+    )
+
+
+def export_data(config: dict, data: dict, engine) -> dict:
+    """
+    Concurrently exports the given tables as Parquet files partitioned by day
+    (see export.py), then lists them in the export manifest. Returns the rows
+    written per table and raises an export.ExportError if any table failed.
+    """
+    # Files are named after the run, which a standalone export starts now
+    config = {**config, "export": {"run": export.run_id(), **config["export"]}}
+    futures = {}
+    with ThreadPoolExecutor(max_workers=config["scheduler"]["max-workers"]) as executor:
+        for table, df in data.items():
+            future = executor.submit(
+                instrument.call,
+                f"export/{table}",
+                export_table,
+                df,
+                table,
+                config,
+                engine,
+            )
+            futures[future] = table
+        rows = export.collect_exports(futures)
+    export.update_manifest(config, list(data))
+    return rows
@@ -0,0 +1,239 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Exports the tables of the ETL process as Parquet files
+              partitioned by load date and reads them back for analysis
+"""
+from datetime import datetime, timezone
+import json
+import logging
+import os
+import pandas as pd
+import pyarrow as pa
+from pyarrow import dataset as ds
+from pyarrow import fs
+import pyarrow.parquet as pq
+import instrument
+
+MANIFEST = "manifest.json"
+# Directory of the rows whose partition value is missing, as Hive names it
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+class ExportError(Exception):
+    """Raised when one or more tables fail to export, with the error of each table"""
+
+    def __init__(self, errors: dict):
+        self.errors = errors
+        super().__init__(
+            "Failed to export "
+            + ", ".join(f"{table} ({err!r})" for table, err in errors.items())
+        )
+
+
+def run_id(started: float = None) -> str:
+    """
+    Returns the name of the files written by the run started at @param started
+    (a time.time() timestamp, default now)
+    """
+    started = datetime.now(timezone.utc).timestamp() if started is None else started
+    return datetime.fromtimestamp(started, timezone.utc).strftime("%Y%m%dT%H%M%S")
+
+
+def day_partitions(df: pd.DataFrame, column: str) -> list:
+    """
+    Returns the (partition value, rows) of each day in the given column of the
+    DataFrame, formatted as YYYY-MM-DD (NULL_PARTITION for missing days)
+    """
+    codes, days = pd.factorize(df[column])
+    names = pd.to_datetime(days).strftime("%Y-%m-%d")
+    if len(days) == 1 and not (codes < 0).any():
+        return [(names[0], df)]
+    parts = [(name, df[codes == i]) for i, name in enumerate(names)]
+    if (codes < 0).any():
+        parts.append((NULL_PARTITION, df[codes < 0]))
+    return parts
+
+
+def write_table(df: pd.DataFrame, table: str, config: dict, part: int = 0) -> int:
+    """
+    Writes the given DataFrame of a table to the export directory, one Parquet
+    file per day of its export.partition-by column, named after the run (and
+    the hash partition @param part, see scheduler.run_partitioned). The files
+    are only read once update_manifest lists them. Returns the rows written.
+    """
+    options = config["export"]
+    column = options["partition-by"]
+    directory = os.path.join(options["dir"], config[table]["tablename"])
+    if column not in df.columns:
+        parts = [(None, df)]
+    else:
+        parts = day_partitions(df, column)
+    for day, rows in parts:
+        folder = (
+            directory if day is None else os.path.join(directory, f"{column}={day}")
+        )
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{options['run']}-{part:04d}.parquet")
+        # Write to a temporary file first so no partial file is ever listed
+        pq.write_table(
+            pa.Table.from_pandas(rows, preserve_index=False),
+            f"{path}.tmp",
+            compression=options["compression"],
+            compression_level=options.get("compression-level"),
+            row_group_size=options["row-group-rows"],
+        )
+        os.replace(f"{path}.tmp", path)
+    return len(df)
+
+
+def collect_exports(futures: dict) -> dict:
+    """
+    Waits for the given export futures (future -> table) and returns the rows
+    written for each table. A failure does not stop the other exports, and an
+    ExportError with the error of each failed table is raised at the end.
+    """
+    rows = {}
+    errors = {}
+    for future, table in futures.items():
+        try:
+            rows[table] = rows.get(table, 0) + future.result()
+        except Exception as err:  # pylint: disable=broad-except
+            logging.exception("Failed to export %s", table)
+            errors.setdefault(table, err)
+    if errors:
+        raise ExportError(errors)
+    return rows
+
+
+def read_manifest(directory: str) -> dict:
+    """Returns the manifest of the export directory (empty if there is none)"""
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {"tables": {}}
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def run_files(config: dict, table: str) -> list:
+    """Returns the manifest entries of the files of the current run of a table"""
+    options = config["export"]
+    directory = options["dir"]
+    tablename = config[table]["tablename"]
+    entries = []
+    for root, _, names in os.walk(os.path.join(directory, tablename)):
+        for name in sorted(names):
+            if not (
+                name.startswith(f"{options['run']}-") and name.endswith(".parquet")
+            ):
+                continue
+            path = os.path.join(root, name)
+            metadata = pq.read_metadata(path)
+            folder = os.path.basename(root)
+            prefix = f"{options['partition-by']}="
+            entries.append(
+                {
+                    "path": os.path.relpath(path, directory).replace(os.sep, "/"),
+                    "partition": folder[len(prefix) :]
+                    if folder.startswith(prefix)
+                    else None,
+                    "rows": metadata.num_rows,
+                    "bytes": os.path.getsize(path),
+                }
+            )
+    return entries
+
+
+def update_manifest(config: dict, tables: list) -> dict:
+    """
+    Lists the files the current run wrote for the given tables in the manifest,
+    replacing the files of the days it rewrote and keeping those of the other
+    days, then removes the files no longer listed from the days it rewrote.
+    The manifest is replaced atomically. Returns the manifest.
+    """
+    options = config["export"]
+    directory = options["dir"]
+    manifest = read_manifest(directory)
+    rewritten = []
+    for table in tables:
+        tablename = config[table]["tablename"]
+        files = run_files(config, table)
+        days = {entry["partition"] for entry in files}
+        previous = manifest["tables"].get(tablename, {}).get("files", [])
+        files = [entry for entry in previous if entry["partition"] not in days] + files
+        files.sort(key=lambda entry: (entry["partition"] or "", entry["path"]))
+        latest = os.path.join(directory, files[-1]["path"]) if files else None
+        manifest["tables"][tablename] = {
+            "table": table,
+            "partition-by": options["partition-by"],
+            "columns": pq.read_schema(latest).names if latest else [],
+            "rows": sum(entry["rows"] for entry in files),
+            "files": files,
+        }
+        rewritten += [(tablename, day) for day in days]
+    manifest["run"] = options["run"]
+    manifest["updated"] = datetime.now(timezone.utc).isoformat()
+    os.makedirs(directory, exist_ok=True)
+    instrument.write_atomic(
+        os.path.join(directory, MANIFEST), json.dumps(manifest, indent=2)
+    )
+    # Only now that the manifest no longer lists them are stale files removed
+    listed = {
+        os.path.join(directory, entry["path"])
+        for listing in manifest["tables"].values()
+        for entry in listing["files"]
+    }
+    for tablename, day in rewritten:
+        folder = os.path.join(directory, tablename)
+        if day is not None:
+            folder = os.path.join(folder, f"{options['partition-by']}={day}")
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if name.endswith(".parquet") and path not in listed:
+                os.remove(path)
+    logging.info("Export manifest written to %s", directory)
+    return manifest
+
+
+def open_dataset(directory: str, table: str, days: list = None):
+    """
+    Returns a pyarrow dataset over the exported files of a table (its tablename
+    or its name in tables.yml), or only those of the given days (dates or
+    YYYY-MM-DD strings). The files are memory mapped.
+    """
+    tables = read_manifest(directory)["tables"]
+    names = {entry["table"]: tablename for tablename, entry in tables.items()}
+    entry = tables.get(names.get(table, table))
+    if entry is None:
+        raise KeyError(
+            f"{table} is not exported to {directory}, choose from {sorted(tables)}"
+        )
+    files = entry["files"]
+    if days is not None:
+        wanted = {pd.Timestamp(day).strftime("%Y-%m-%d") for day in days}
+        files = [file for file in files if file["partition"] in wanted]
+    paths = [os.path.join(directory, file["path"]) for file in files]
+    filesystem = fs.LocalFileSystem(use_mmap=True)
+    # Days written by different runs may hold different (compatible) types
+    schema = pa.unify_schemas(
+        [pq.read_schema(path, memory_map=True) for path in paths] or [pa.schema([])],
+        promote_options="permissive",
+    )
+    return ds.dataset(paths, schema=schema, format="parquet", filesystem=filesystem)
+
+
+def read_table(
+    directory: str,
+    table: str,
+    columns: list = None,
+    filters=None,
+    days: list = None,
+) -> pd.DataFrame:
+    """
+    Returns the exported rows of a table, only the given @param columns,
+    @param days and rows matching @param filters
+    """
+    if filters is not None and not isinstance(filters, ds.Expression):
+        filters = pq.filters_to_expression(filters)
+    dataset = open_dataset(directory, table, days)
+    return dataset.to_table(columns=columns, filter=filters).to_pandas()
@@ -0,0 +1,258 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Fetches the raw MyAnimeList data from the Jikan API, page by
+              page, in batches shaped like the raw CSVs
+"""
+from datetime import datetime, timezone
+import asyncio
+import json
+import logging
+import os
+import time
+import aiohttp
+import pandas as pd
+import cache
+import etl
+import instrument
+
+# Raw columns of the fetched records of each source table, like the raw CSVs
+COLUMNS = {
+    "all-anime": [
+        "id",
+        "title",
+        "status",
+        "rating",
+        "score",
+        "favorites",
+        "airing",
+        "aired_from",
+        "aired_to",
+        "load_date",
+    ],
+    "anime-stats": [
+        "anime_id",
+        "watching",
+        "completed",
+        "on_hold",
+        "dropped",
+        "plan_to_watch",
+        "total",
+        "load_date",
+    ],
+    "anime-scores": ["anime_id", "score", "votes", "percentage", "load_date"],
+}
+# Responses worth retrying: rate limited or a server error
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Paces requests to @param rate per second on average, allowing bursts of up
+    to @param burst requests
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Waits until a request may be sent"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def get_json(session, bucket: TokenBucket, url: str, options: dict, **params):
+    """
+    Returns the JSON body of a GET request, or None if the resource does not
+    exist. Rate limited and failed requests are retried up to api.retries times,
+    waiting api.backoff seconds (doubled on every retry, or the server's
+    Retry-After) in between.
+    """
+    for attempt in range(options["retries"] + 1):
+        await bucket.acquire()
+        delay = options["backoff"] * 2**attempt
+        try:
+            async with session.get(url, params=params or None) as response:
+                if response.status == 404:
+                    return None
+                if response.status not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return await response.json()
+                delay = float(response.headers.get("Retry-After", delay))
+                error = f"HTTP {response.status}"
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+            error = repr(err)
+        if attempt == options["retries"]:
+            raise RuntimeError(f"GET {url} failed after {attempt + 1} tries: {error}")
+        logging.warning("GET %s failed (%s), retrying in %.1fs", url, error, delay)
+        await asyncio.sleep(delay)
+    return None
+
+
+def page_records(anime: list, statistics: list, load_date: str) -> dict:
+    """
+    Returns the records of each source table (see COLUMNS) for one page of the
+    anime listing and the statistics of each of its anime
+    """
+    records = {table: [] for table in COLUMNS}
+    for item, stats in zip(anime, statistics):
+        aired = item.get("aired") or {}
+        records["all-anime"].append(
+            [
+                item["mal_id"],
+                item.get("title"),
+                item.get("status"),
+                item.get("rating"),
+                item.get("score"),
+                item.get("favorites"),
+                "t" if item.get("airing") else "f",
+                aired.get("from"),
+                aired.get("to"),
+                load_date,
+            ]
+        )
+        if stats is None:
+            continue
+        stats = stats["data"]
+        records["anime-stats"].append(
+            [item["mal_id"]]
+            + [stats.get(col) for col in COLUMNS["anime-stats"][1:-1]]
+            + [load_date]
+        )
+        for score in stats.get("scores", []):
+            records["anime-scores"].append(
+                [
+                    item["mal_id"],
+                    score["score"],
+                    score["votes"],
+                    score["percentage"],
+                    load_date,
+                ]
+            )
+    return records
+
+
+def read_cursor(path: str, load_date: str) -> dict:
+    """
+    Returns the cursor of the fetch of the given load date: the next page to
+    fetch (None once every page was fetched), starting over on another day
+    """
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            cursor = json.load(file)
+        if cursor["load-date"] == load_date:
+            return cursor
+    return {"load-date": load_date, "next-page": 1, "pages": []}
+
+
+def today() -> str:
+    """Returns the load date of the data fetched now (the current UTC day)"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def snapshot(config: dict) -> list:
+    """
+    Returns what the data fetch_batches yields depends on: the load date, since
+    the pages of a day are only fetched once (see crawl), and the API options
+    """
+    return [today(), config["api"]]
+
+
+async def crawl(config: dict, load_date: str):
+    """
+    Yields the raw records of each page of the anime listing (table ->
+    DataFrame), resuming from the cursor under api.state-dir
+    """
+    options = config["api"]
+    state = options["state-dir"]
+    cursor_path = os.path.join(state, "cursor.json")
+    cursor = read_cursor(cursor_path, load_date)
+    for page in cursor["pages"]:
+        yield {
+            table: cache.load(os.path.join(state, table), f"{page:06d}")
+            for table in COLUMNS
+        }
+    bucket = TokenBucket(options["rate"], options["burst"])
+    connector = aiohttp.TCPConnector(limit=options["concurrency"])
+    timeout = aiohttp.ClientTimeout(total=options["timeout"])
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        page = cursor["next-page"]
+        while page and (not options["max-pages"] or page <= options["max-pages"]):
+            listing = await get_json(
+                session,
+                bucket,
+                f"{options['base-url']}/anime",
+                options,
+                page=page,
+                limit=options["page-size"],
+            )
+            anime = listing["data"]
+            statistics = await asyncio.gather(
+                *[
+                    get_json(
+                        session,
+                        bucket,
+                        f"{options['base-url']}/anime/{item['mal_id']}/statistics",
+                        options,
+                    )
+                    for item in anime
+                ]
+            )
+            batches = {}
+            for table, records in page_records(anime, statistics, load_date).items():
+                batches[table] = pd.DataFrame(records, columns=COLUMNS[table])
+                cache.store(os.path.join(state, table), f"{page:06d}", batches[table])
+            cursor["pages"].append(page)
+            page = page + 1 if listing["pagination"]["has_next_page"] else None
+            cursor["next-page"] = page
+            os.makedirs(state, exist_ok=True)
+            instrument.write_atomic(cursor_path, json.dumps(cursor))
+            logging.info("Fetched page %s of the anime listing", cursor["pages"][-1])
+            yield batches
+
+
+def fetch_batches(config: dict, tables: list):
+    """
+    Fetches the raw data of the given source tables from the API, resuming an
+    interrupted fetch of the same day, and yields the record batches of each
+    page (table -> batch) as they arrive, typed by each table's csv-schema like
+    etl.read_raw_data types the CSVs
+    """
+    schemas = {table: config[table].get("csv-schema") for table in tables}
+    loop = asyncio.new_event_loop()
+    pages = crawl(config, today())
+    fetched = False
+    try:
+        while True:
+            try:
+                batches = loop.run_until_complete(pages.__anext__())
+            except StopAsyncIteration:
+                break
+            fetched = True
+            yield {
+                table: etl.type_raw_data(batches[table], schemas[table])
+                for table in tables
+            }
+        if not fetched:
+            yield {
+                table: etl.type_raw_data(
+                    pd.DataFrame(columns=COLUMNS[table]), schemas[table]
+                )
+                for table in tables
+            }
+    finally:
+        loop.run_until_complete(pages.aclose())
+        loop.close()
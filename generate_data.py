@@ -0,0 +1,139 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Generates synthetic MyAnimeList data shaped like the raw CSVs
+              read by the ETL process
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+STATUSES = ["Finished Airing", "Currently Airing", "Not yet aired"]
+STATUS_WEIGHTS = [0.85, 0.05, 0.10]
+RATINGS = [
+    "G - All Ages",
+    "PG - Children",
+    "PG-13 - Teens 13 or older",
+    "R - 17+ (violence & profanity)",
+    "R+ - Mild Nudity",
+]
+RATING_WEIGHTS = [0.15, 0.15, 0.5, 0.15, 0.05]
+SCORES = np.arange(1, 11)
+BLOCK_SIZE = 100000
+# Raw files in raw-data-loc order
+FILES = ["all_anime", "anime_stats", "anime_scores"]
+
+
+def iso_dates(days: np.ndarray) -> pd.Series:
+    """Formats day offsets from 1970-01-01 the way the API returns them"""
+    dates = pd.Series(pd.to_datetime(days, unit="D"))
+    return dates.dt.strftime("%Y-%m-%dT00:00:00+00:00")
+
+
+def with_duplicates(df: pd.DataFrame, rate: float, rng) -> pd.DataFrame:
+    """Returns the DataFrame with a fraction of its rows repeated at the end"""
+    repeats = df.sample(frac=rate, random_state=rng.integers(1 << 31))
+    return pd.concat([df, repeats], ignore_index=True)
+
+
+def anime_block(ids: np.ndarray, load_date: str, rng) -> pd.DataFrame:
+    """Returns the all_anime rows for the given ids"""
+    size = len(ids)
+    status = rng.choice(len(STATUSES), size=size, p=STATUS_WEIGHTS)
+    aired_from = rng.integers(0, 19000, size=size)
+    aired_to = pd.Series(iso_dates(aired_from + rng.integers(0, 700, size=size)))
+    # Only finished shows have an end date, and unaired ones have no score
+    aired_to[status != 0] = None
+    score = np.round(rng.normal(6.8, 0.9, size=size).clip(1, 10), 2)
+    return pd.DataFrame(
+        {
+            "id": ids,
+            "title": [f"Anime {i}" for i in ids],
+            "status": np.array(STATUSES)[status],
+            "rating": rng.choice(RATINGS, size=size, p=RATING_WEIGHTS),
+            "score": np.where(status == 2, np.nan, score),
+            "favorites": rng.zipf(2.0, size=size).clip(0, 250000) - 1,
+            "airing": np.where(status == 1, "t", "f"),
+            "aired_from": iso_dates(aired_from),
+            "aired_to": aired_to,
+            "load_date": load_date,
+        }
+    )
+
+
+def stats_block(ids: np.ndarray, load_date: str, rng) -> pd.DataFrame:
+    """Returns the anime_stats rows for the given ids"""
+    size = len(ids)
+    counts = {
+        col: rng.zipf(1.8, size=size).clip(0, 3000000) - 1
+        for col in ["watching", "completed", "on_hold", "dropped", "plan_to_watch"]
+    }
+    df = pd.DataFrame({"anime_id": ids, **counts})
+    df["total"] = df[list(counts)].sum(axis=1)
+    df["load_date"] = load_date
+    return df
+
+
+def scores_block(ids: np.ndarray, load_date: str, rng) -> pd.DataFrame:
+    """Returns the anime_scores rows (one per anime and score) for the given ids"""
+    # Votes follow a bell curve around each anime's mean score
+    means = rng.normal(7, 1, size=(len(ids), 1))
+    weights = np.exp(-((SCORES - means) ** 2) / 4)
+    votes = np.floor(weights * rng.lognormal(6, 2, size=(len(ids), 1)))
+    totals = votes.sum(axis=1, keepdims=True)
+    percentage = np.round(np.divide(votes, totals, where=totals > 0) * 100, 1)
+    return pd.DataFrame(
+        {
+            "anime_id": ids.repeat(len(SCORES)),
+            "score": np.tile(SCORES, len(ids)),
+            "votes": votes.astype("int64").ravel(),
+            "percentage": np.where(totals > 0, percentage, 0).ravel(),
+            "load_date": load_date,
+        }
+    )
+
+
+def generate(
+    out: str,
+    anime: int,
+    duplicate_rate: float = 0.01,
+    load_date: str = "2022-06-27",
+    seed: int = 0,
+) -> list:
+    """
+    Writes all_anime.csv, anime_stats.csv and anime_scores.csv for the given
+    number of anime to the output directory, in blocks so that any scale fits in
+    memory. Returns the paths in the order expected by raw-data-loc.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out, exist_ok=True)
+    blocks = [anime_block, stats_block, scores_block]
+    paths = [os.path.join(out, f"{name}.csv") for name in FILES]
+    for start in range(0, anime, BLOCK_SIZE):
+        ids = np.arange(start + 1, min(start + BLOCK_SIZE, anime) + 1)
+        for path, block in zip(paths, blocks):
+            df = with_duplicates(block(ids, load_date, rng), duplicate_rate, rng)
+            df.to_csv(
+                path, mode="w" if start == 0 else "a", header=start == 0, index=False
+            )
+    return paths
+
+
+def main():
+    """Generates the synthetic data from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--out", default="data")
+    parser.add_argument("--anime", type=int, default=10000)
+    parser.add_argument("--duplicate-rate", type=float, default=0.01)
+    parser.add_argument("--load-date", default="2022-06-27")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for path in generate(
+        args.out, args.anime, args.duplicate_rate, args.load_date, args.seed
+    ):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: The stage graph of the ETL process, derived from the table
+              definitions in tables.yml
+"""
+import copy
+
+
+def upstream(config: dict, tables: list) -> list:
+    """
+    Returns the given tables and every table they are computed from, each one
+    after its inputs
+    """
+    ordered = []
+
+    def visit(table):
+        if table in ordered:
+            return
+        for name in config[table].get("inputs", []):
+            visit(name)
+        ordered.append(table)
+
+    for table in tables:
+        visit(table)
+    return ordered
+
+
+def used_columns(config: dict, table: str) -> set:
+    """Returns the columns a derived table reads from its inputs"""
+    definition = config[table]
+    if definition["transform"] == "pivot":
+        return {definition["index"], definition["pivot-on"], definition["values"]}
+    return set(config["anime-stats-scores"]["columns"])
+
+
+def prune_definition(definition: dict, columns: set) -> dict:
+    """
+    Returns a copy of a source table's definition that only reads and cleans
+    the given (renamed) columns, its dupe-index and its partition-key
+    """
+    definition = copy.deepcopy(definition)
+    rename = definition.get("rename", {})
+    raw = {new: old for old, new in rename.items()}
+    keep = {raw.get(col, col) for col in set(columns) | set(definition["dupe-index"])}
+    keep.add(definition["partition-key"])
+    schema = definition["csv-schema"]
+    schema["usecols"] = [col for col in schema["usecols"] if col in keep]
+    for key in ("dtypes", "dates"):
+        if key in schema:
+            schema[key] = {col: v for col, v in schema[key].items() if col in keep}
+    if "categories" in schema:
+        schema["categories"] = [col for col in schema["categories"] if col in keep]
+    cleaned = {rename.get(col, col) for col in schema["usecols"]}
+    for key in ("datecols", "day-keys"):
+        if key in definition:
+            definition[key] = [col for col in definition[key] if col in cleaned]
+    for key in ("conversion", "compact"):
+        if key in definition:
+            definition[key] = {
+                col: v for col, v in definition[key].items() if col in cleaned
+            }
+    return definition
+
+
+def prune_sources(config: dict, tables: list, targets: list) -> dict:
+    """
+    Returns a copy of the configuration in which the source tables among
+    @param tables that are only computed for other tables (i.e. not loaded, not
+    in @param targets) read and clean only the columns those tables use
+    """
+    pruned = copy.deepcopy(config)
+    for table in config["source-tables"]:
+        if table not in tables or table in targets:
+            continue
+        columns = set()
+        for consumer in tables:
+            if table in config[consumer].get("inputs", []):
+                columns |= used_columns(config, consumer)
+        pruned[table] = prune_definition(config[table], columns)
+    return pruned
+
+
+def stage_group(config: dict, table: str) -> tuple:
+    """
+    Returns the stage a table is computed in. Tables in the same stage are built
+    together: each source is cleaned on its own (or, fetched from the API, all of
+    them in a single fetch), pivots of the same input share a single pass, and
+    the joins share their common base.
+    """
+    definition = config[table]
+    transform = definition["transform"]
+    if transform == "clean" and config["source"] == "api":
+        return ("fetch",)
+    if transform == "clean":
+        return (transform, table)
+    if transform == "pivot":
+        return (transform, *definition["inputs"], definition["pivot-on"])
+    return (transform,)
+
+
+def build_stages(config: dict, tables: list) -> list:
+    """
+    Returns the stages that compute the given tables, each with the tables it
+    produces and the tables it reads
+    """
+    paths = dict(zip(config["source-tables"], config["raw-data-loc"]))
+    stages = {}
+    for table in tables:
+        group = stage_group(config, table)
+        stage = stages.setdefault(
+            group,
+            {"name": "/".join(group), "transform": group[0], "tables": []},
+        )
+        stage["tables"].append(table)
+    for stage in stages.values():
+        inputs = []
+        for table in stage["tables"]:
+            inputs += [
+                name
+                for name in config[table].get("inputs", [])
+                if name not in inputs and name not in stage["tables"]
+            ]
+        stage["inputs"] = inputs
+        stage["paths"] = {
+            table: paths[table]
+            for table in stage["tables"]
+            if table in paths and stage["transform"] == "clean"
+        }
+    return list(stages.values())
@@ -6,88 +6,672 @@ data from the MyAnimeList API. This process is meant to be invoked once,
 but it is idempotent and can be run multiple times while still yielding
 the same data and structure.
 """
+import argparse
+import copy
+import dataclasses
 import logging
+import os
+import signal
+import threading
+import time
 import yaml
 from yaml.loader import SafeLoader
-import psycopg2
-from DBToolBox.DataConnectors import get_alchemy_engine_db
+import graph
 import sql
-import etl
 
+# The pipeline's modules (pandas, the database drivers...) are imported by the
+# functions that run it, so that --help, --dry-run and --validate start quickly
+# pylint: disable=import-outside-toplevel
 
-def main():
-    """The main/driver method for the ETL process"""
+# Tables derived from the base tables, in the order they have to be built
+DERIVED_TABLES = [
+    "anime-votes-raw",
+    "anime-votes-pct",
+    "anime-stats-scores-raw",
+    "anime-stats-scores-pct",
+]
+CONFIG_PATH = "tables.yml"
+# Sections of tables.yml every run reads
+SECTIONS = [
+    "raw-data-loc",
+    "source-tables",
+    "source",
+    "api",
+    "incremental",
+    "cache",
+    "scheduler",
+    "partitioned",
+    "indexing",
+    "history",
+    "staged",
+    "export",
+    "watch",
+    "dim-day",
+    "instrumentation",
+]
+TRANSFORMS = {
+    "clean": ["csv-schema", "partition-key"],
+    "pivot": ["inputs", "index", "pivot-on", "values", "columns", "load-date"],
+    "join": ["inputs"],
+}
+
+
+@dataclasses.dataclass
+class RunOptions:
+    """The options of a run, one per command line flag (see parse_args)"""
+
+    incremental: bool = False
+    transform_in_db: bool = False
+    use_cache: bool = True
+    profile: str = None
+    partitions: int = None
+    history: bool = False
+    staged: bool = False
+    tables: list = None
+    source: str = None
+    export_parquet: bool = False
+    resume: bool = False
+    dry_run: bool = False
+
+
+def main(
+    options: RunOptions = None,
+    config: dict = None,
+    engine=None,
+    stop: threading.Event = None,
+):
+    """
+    The main/driver method for the ETL process, run with the given @param
+    options (see parse_args). A daemon (see watch) passes its parsed @param
+    config, its @param engine and its @param stop event.
+    """
+    options = RunOptions() if options is None else options
     # Load our configuration parameters and table definitions
-    with open(r"tables.yml", "r", encoding="utf-8") as file:
-        config = yaml.load(file, Loader=SafeLoader)
-    logging.basicConfig(
-        level=logging.INFO,
-        filename="coop-da-etl.log",
-        format="%(asctime)s:%(levelname)s:%(message)s",
+    config = read_config() if config is None else copy.deepcopy(config)
+    configure_logging()
+    started = time.time()
+    status = "failed"
+    incremental, resume = options.incremental, options.resume
+    if options.profile:
+        config["instrumentation"]["profile"] = options.profile
+    partitions = options.partitions
+    if partitions is None:
+        partitions = config["partitioned"]["partitions"]
+    if options.history:
+        config["history"]["enabled"] = True
+    history = config["history"]["enabled"]
+    if history and options.transform_in_db:
+        raise ValueError("History mode cannot build the derived tables in the database")
+    if options.staged:
+        config["staged"]["enabled"] = True
+    staged = config["staged"]["enabled"]
+    if staged and incremental:
+        raise ValueError("Incremental loads upsert in place and cannot be staged")
+    if options.export_parquet:
+        config["export"]["enabled"] = True
+    every_table = config["source-tables"] + DERIVED_TABLES
+    targets, computed, built, tables, loads = plan_tables(
+        config, options.tables, options.transform_in_db
     )
+    config = graph.prune_sources(config, tables, loads)
+    if options.source:
+        config["source"] = options.source
+    source = config["source"]
+    if options.dry_run:
+        print(describe_plan(config, tables, loads, built, partitions, source))
+        return
+    import psycopg2
+    from DBToolBox.DataConnectors import get_alchemy_engine_db
+    import cache
+    import dimensions
+    import etl
+    import export
+    import instrument
+    import runs
+    import scheduler
+
+    instrument.configure(config["instrumentation"])
+    # The run manifest and the exported files are named after the run
+    run_id = export.run_id(started)
+    config["export"]["run"] = run_id
     logging.info("Beginning ETL Process...")
-    print("Beginning ETL Process...")
-    # Get raw data
-    all_anime, anime_stats, anime_scores = etl.ingest_raw_data(config["raw-data-loc"])
-    # Clean the data
-    logging.info("Cleaning and transforming raw data")
-    print("Cleaning and transforming raw data")
-    all_anime = etl.clean_data(all_anime, config["all-anime"])
-    anime_scores = etl.clean_data(anime_scores, config["anime-scores"])
-    anime_stats = etl.clean_data(anime_stats, config["anime-stats"])
-    # Transform the data
-    anime_votes_raw = etl.create_pivot_table(anime_scores, config, "anime-votes-raw")
-    anime_votes_pct = etl.create_pivot_table(anime_scores, config, "anime-votes-pct")
-    # Create tables with stats and scores merged
-    anime_stats_and_scores_raw = etl.join_data(
-        config, all_anime, anime_votes_raw, anime_stats
-    )
-    anime_stats_and_scores_pct = etl.join_data(
-        config, all_anime, anime_votes_pct, anime_stats
-    )
-    # Load to database
+    stage_cache = config["cache"] if options.use_cache else None
+    # Where the tables are loaded: a scratch schema in staged mode
+    load_config = etl.staged_config(config, every_table) if staged else config
+    own_engine = engine is None
+    started_run = False
     try:
-        engine = get_alchemy_engine_db()
+        if own_engine:
+            engine = get_alchemy_engine_db()
+        runs.start(engine, run_id)
+        started_run = True
         logging.info("Creating Schemas...")
-        print("Creating Schemas...")
+        blocks = {
+            "sql/create-schema": sql.ENSURE_SCHEMA
+            if incremental
+            or history
+            or staged
+            or resume
+            or set(targets) != set(every_table)
+            else sql.CREATE_SCHEMA,
+            "sql/create-extension": "CREATE EXTENSION IF NOT EXISTS tablefunc;",
+        }
+        if staged:
+            # A resumed run keeps what the previous one staged
+            create = sql.ENSURE_STAGING_SCHEMA if resume else sql.CREATE_STAGING_SCHEMA
+            blocks["sql/create-staging-schema"] = create.format(
+                schema=config["staged"]["schema"]
+            )
         with engine.connect() as conn:
             # Create schema
-            etl.execute_sql(
-                conn,
-                [
-                    sql.CREATE_SCHEMA,
-                    sql.CREATE_DIM_DAY,
-                    "CREATE EXTENSION IF NOT EXISTS tablefunc;",
-                ],
+            run_sql(conn, blocks)
+            dim_day_changed = instrument.call(
+                "sql/dim-day", dimensions.ensure_dim_day, conn, config["dim-day"]
             )
-        # Insert raw data
-        logging.info("Inserting data into database...")
-        print("Inserting data into database...")
-        # Prep DataFrames for insertion
-        data = {
-            "all-anime": all_anime,
-            "anime-scores": anime_scores,
-            "anime-stats": anime_stats,
-            "anime-votes-raw": anime_votes_raw,
-            "anime-votes-pct": anime_votes_pct,
-            "anime-stats-scores-raw": anime_stats_and_scores_raw,
-            "anime-stats-scores-pct": anime_stats_and_scores_pct,
-        }
-        etl.load_data_concurrent(config, data, engine)
-        # Add metadata and analyze column statistics
+        check_stop(stop)
+        # Only the stage cache needs the contents of the raw data hashed
+        hashed = stage_cache is not None and not partitions
+        keys = instrument.call("stage-keys", stage_keys, config, computed, hashed)
+        hashes = load_hashes(load_config, loads + built, keys)
+        pending, building = loads, built
+        if resume:
+            done = runs.carry_over(engine, run_id, "load", hashes)
+            pending = [table for table in loads if table not in done]
+            building = [table for table in built if table not in done]
+            # Only what the loads to retry are computed from is computed again
+            tables = [t for t in graph.upstream(config, pending) if t in tables]
+        # Clean and transform the raw data, inserting each table once it is ready
+        logging.info("Cleaning, transforming and inserting data into database...")
+        try:
+            loaded = {}
+            if pending and partitions:
+                loaded = scheduler.run_partitioned(
+                    load_config, tables, engine, partitions, incremental, pending
+                )
+            elif pending:
+                loaded = scheduler.run_pipeline(
+                    load_config,
+                    tables,
+                    engine,
+                    keys,
+                    stage_cache,
+                    incremental,
+                    pending,
+                )
+        except etl.LoadError as err:
+            runs.record(engine, run_id, "load", "success", err.rows, hashes)
+            runs.record(engine, run_id, "load", "failed", err.errors, hashes)
+            raise
+        runs.record(engine, run_id, "load", "success", loaded, hashes)
+        changed = [table for table, rows in loaded.items() if rows]
+        check_stop(stop)
+        if building:
+            logging.info("Building derived tables in the database...")
+            etl.transform_in_database(load_config, building, engine)
+            runs.record(
+                engine, run_id, "load", "success", dict.fromkeys(building), hashes
+            )
+            changed += building
+        loads = loads + built
+        check_stop(stop)
+        logging.info("Creating keys and indexes...")
+        indexed = {}
+        if resume:
+            skipped = [table for table in loads if table not in pending + building]
+            indexed = runs.carry_over(
+                engine, run_id, "index", {table: hashes[table] for table in skipped}
+            )
+        indexes = [table for table in loads if table not in indexed]
+        instrument.call("index", etl.build_indexes, load_config, indexes, engine)
+        runs.record(engine, run_id, "index", "success", dict.fromkeys(indexes), hashes)
+        if history:
+            logging.info("Applying the history retention policy...")
+            instrument.call(
+                "history/retention", etl.expire_history, config, loads, engine
+            )
+        check_stop(stop)
+        # Add metadata and analyze the column statistics of changed tables
         logging.info("Analyzing column statistics and adding definitions...")
-        print("Analyzing column statistics and adding definitions... almost done...")
+        # Staged tables get their metadata when they are swapped in
+        metadata = etl.metadata_sql(config, loads)
+        blocks = {"sql/add-metadata": metadata} if metadata and not staged else {}
+        queries = analyze_queries(load_config, changed, dim_day_changed)
+        if queries:
+            blocks["sql/analyze"] = "".join(queries)
         with engine.connect() as conn:
-            etl.execute_sql(conn, [sql.ADD_METADATA, sql.ANALYZE_COLUMN_STATS])
+            run_sql(conn, blocks)
+        check_stop(stop)
+        if staged:
+            swapped = {}
+            if resume:
+                # Tables the previous run swapped in are no longer staged
+                swapped = runs.carry_over(
+                    engine, run_id, "swap", {table: hashes[table] for table in loads}
+                )
+            swaps = [table for table in loads if table not in swapped]
+            logging.info("Swapping the staged tables in...")
+            instrument.call("logged", etl.set_logged, load_config, swaps, engine)
+            instrument.call(
+                "swap",
+                etl.swap_staged,
+                config,
+                load_config,
+                swaps,
+                engine,
+                etl.metadata_sql(config, swaps),
+            )
+            runs.record(engine, run_id, "swap", "success", dict.fromkeys(swaps), hashes)
+        status = "success"
         logging.info("Process complete! Data has been successfully loaded to database!")
-        print("Process complete! Data has been successfully loaded to database!")
-    except psycopg2.DatabaseError as err:
+    except Stopped:
+        status = "stopped"
+        raise
+    except psycopg2.DatabaseError:
         logging.exception("A database error occurred")
-        print("A database error occurred", err)
         raise
+    except etl.LoadError as err:
+        logging.error("Some tables failed to load: %s", ", ".join(err.errors))
+        raise
+    except export.ExportError as err:
+        logging.error("Some tables failed to export: %s", ", ".join(err.errors))
+        raise
+    finally:
+        if started_run:
+            try:
+                runs.finish(engine, run_id, status)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Could not record the status of run %s", run_id)
+        if own_engine and engine is not None:
+            engine.dispose()  # Close any remaining connections
+        instrument.write_report(config["instrumentation"], started, status)
+
+
+class Stopped(Exception):
+    """Raised by a run that stopped before its next step (see main)"""
+
+
+def check_stop(stop: threading.Event):
+    """Raises Stopped if the given stop event is set"""
+    if stop is not None and stop.is_set():
+        raise Stopped("Stopped on request")
+
+
+def configure_logging():
+    """Logs to the console and to coop-da-etl.log (once per process)"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s:%(levelname)s:%(message)s",
+        handlers=[logging.FileHandler("coop-da-etl.log"), logging.StreamHandler()],
+    )
+
+
+def read_config(path: str = CONFIG_PATH) -> dict:
+    """Returns the configuration parameters and table definitions in tables.yml"""
+    with open(path, "r", encoding="utf-8") as file:
+        return yaml.load(file, Loader=SafeLoader)
+
+
+def validate_config(config: dict) -> list:
+    """
+    Returns the problems found in the configuration: missing sections, tables
+    without a definition, definitions missing what their transform needs, and
+    inputs, loaders, keys or indexes that do not make sense. Empty if it is
+    valid.
+    """
+    problems = [f"missing section {name}" for name in SECTIONS if name not in config]
+    sources = config.get("source-tables") or []
+    if len(config.get("raw-data-loc") or []) != len(sources):
+        problems.append("raw-data-loc and source-tables differ in length")
+    if config.get("source") not in ("csv", "api"):
+        problems.append(f"source must be csv or api, not {config.get('source')}")
+    tablenames = {}
+    for table in sources + DERIVED_TABLES:
+        definition = config.get(table)
+        if not isinstance(definition, dict):
+            problems.append(f"{table}: no definition")
+            continue
+        required = ["schema", "tablename", "transform"]
+        required += TRANSFORMS.get(definition.get("transform"), [])
+        problems += [
+            f"{table}: missing {key}" for key in required if key not in definition
+        ]
+        if definition.get("transform") not in TRANSFORMS:
+            problems.append(f"{table}: unknown transform {definition.get('transform')}")
+        if (definition.get("transform") == "clean") != (table in sources):
+            problems.append(f"{table}: only source tables are cleaned")
+        for name in definition.get("inputs", []):
+            if name not in sources + DERIVED_TABLES or name == table:
+                problems.append(f"{table}: unknown input {name}")
+        if definition.get("loader", "insert") not in ("insert", "copy"):
+            problems.append(f"{table}: unknown loader {definition['loader']}")
+        for kind, columns in (definition.get("keys") or {}).items():
+            if kind not in ("primary", "unique") or not isinstance(columns, list):
+                problems.append(f"{table}: keys.{kind} must be primary/unique columns")
+        for columns in definition.get("indexes") or []:
+            if not isinstance(columns, list) or not columns:
+                problems.append(f"{table}: every index must be a list of columns")
+        name = f"{definition.get('schema')}.{definition.get('tablename')}"
+        if name in tablenames:
+            problems.append(f"{table}: same table as {tablenames[name]} ({name})")
+        tablenames[name] = table
+    return problems
+
+
+def plan_tables(config: dict, tables: list, transform_in_db: bool) -> tuple:
+    """
+    Returns the tables a run of the given @param tables (default: all) reads:
+    the targets, every table they are computed from, those built in the
+    database with @param transform_in_db, those computed in pandas and those
+    loaded from pandas
+    """
+    every_table = config["source-tables"] + DERIVED_TABLES
+    targets = list(tables or every_table)
+    unknown = [table for table in targets if table not in every_table]
+    if unknown:
+        raise ValueError(f"Unknown tables {unknown}, choose from {every_table}")
+    computed = graph.upstream(config, targets)
+    # Derived tables built in the database read the loaded tables they need
+    built = [table for table in DERIVED_TABLES if table in computed]
+    if not transform_in_db:
+        built = []
+    tables = [table for table in computed if table not in built]
+    loads = tables if transform_in_db else targets
+    return targets, computed, built, tables, loads
+
+
+def describe_plan(
+    config: dict, tables: list, loads: list, built: list, partitions: int, source: str
+) -> str:
+    """Returns what a run would compute and load, for --dry-run"""
+    lines = [f"Source: {source}"]
+    if partitions:
+        lines.append(f"Out of core in {partitions} partitions")
+    for stage in graph.build_stages(config, tables):
+        inputs = stage["inputs"] or list(stage["paths"].values())
+        if stage["transform"] == "fetch":
+            inputs = [config["api"]["base-url"]]
+        lines.append(
+            f"Stage {stage['name']}: {', '.join(map(str, inputs))}"
+            f" -> {', '.join(stage['tables'])}"
+        )
+    for table in loads:
+        definition = config[table]
+        lines.append(
+            f"Load {table} into {definition['schema']}.{definition['tablename']}"
+            f" ({definition.get('loader', 'insert')})"
+        )
+    for table in built:
+        definition = config[table]
+        lines.append(
+            f"Build {table} in {definition['schema']}.{definition['tablename']}"
+        )
+    return "\n".join(lines)
+
+
+def source_state(paths: list) -> tuple:
+    """Returns the size and modification time of each file (None if missing)"""
+    state = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            state.append((path, None, None))
+        else:
+            state.append((path, stat.st_size, stat.st_mtime_ns))
+    return tuple(state)
+
+
+def watch_problems(config: dict, path: str = CONFIG_PATH) -> list:
+    """
+    Returns the problems that keep the watch daemon from running with the given
+    configuration (see validate_config). Empty if it can run.
+    """
+    problems = validate_config(config)
+    if not problems and (config["staged"]["enabled"] or config["source"] != "csv"):
+        problems.append(
+            "watch mode runs incremental loads of the raw-data-loc files, "
+            "so it needs staged.enabled off and source csv"
+        )
+    return [f"{path}: {problem}" for problem in problems]
+
+
+def watch(path: str = CONFIG_PATH, options: RunOptions = None):
+    """
+    Runs as a daemon until SIGTERM or SIGINT, loading the raw data with the
+    given @param options whenever it changes (see the watch section)
+    """
+    from DBToolBox.DataConnectors import get_alchemy_engine_db
+
+    options = RunOptions() if options is None else options
+    configure_logging()
+    config = read_config(path)
+    problems = watch_problems(config, path)
+    if problems:
+        raise ValueError("; ".join(problems))
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    engine = get_alchemy_engine_db()
+    config_state = source_state([path])
+    processed = None
+    resume = False
+    logging.info("Watching %s", ", ".join(config["raw-data-loc"]))
+    try:
+        while not stop.is_set():
+            if source_state([path]) != config_state:
+                config_state = source_state([path])
+                changed = read_config(path)
+                problems = watch_problems(changed, path)
+                if problems:
+                    logging.error("Ignoring the new %s: %s", path, "; ".join(problems))
+                else:
+                    logging.info("Reloaded %s", path)
+                    config, processed = changed, None
+            state = source_state(config["raw-data-loc"])
+            if state == processed:
+                stop.wait(config["watch"]["interval-seconds"])
+                continue
+            # Wait for the files to be completely written
+            if stop.wait(config["watch"]["settle-seconds"]):
+                break
+            if source_state(config["raw-data-loc"]) != state:
+                continue
+            try:
+                main(
+                    dataclasses.replace(
+                        options,
+                        incremental=True,
+                        staged=False,
+                        source=None,
+                        dry_run=False,
+                        resume=resume,
+                    ),
+                    config=config,
+                    engine=engine,
+                    stop=stop,
+                )
+            except Stopped:
+                logging.info("Run stopped")
+            except Exception:  # pylint: disable=broad-except
+                logging.exception(
+                    "Run failed, resuming it in %ss", config["watch"]["retry-seconds"]
+                )
+                resume = True
+                stop.wait(config["watch"]["retry-seconds"])
+            else:
+                processed, resume = state, False
     finally:
-        engine.dispose()  # Close any remaining connections
+        engine.dispose()
+        logging.info("Stopped watching")
+
+
+def analyze_queries(config: dict, tables: list, dim_day_changed: bool) -> list:
+    """
+    Returns the ANALYZE statements of the given tables and of dim_day if it
+    changed, i.e. of the tables whose content changed in this run
+    """
+    names = ["public.dim_day"] if dim_day_changed else []
+    names += [
+        f"{config[table]['schema']}.{config[table]['tablename']}" for table in tables
+    ]
+    return [sql.ANALYZE_TABLE.format(table=name) for name in names]
+
+
+def run_sql(conn, blocks: dict):
+    """Runs each named SQL block (stage name -> query) as its own stage"""
+    import etl
+    import instrument
+
+    for stage, query in blocks.items():
+        instrument.call(stage, etl.execute_sql, conn, [query])
+
+
+def stage_keys(config: dict, tables: list, hashed: bool = True) -> dict:
+    """
+    Returns the stage cache key of each of the given tables. Unless @param
+    hashed, raw data files are keyed by their size and modification time
+    """
+    import cache
+    import etl
+    import fetch
+    import scheduler
+
+    # Every module the stage outputs are computed by
+    modules = [cache, etl, fetch, graph, scheduler]
+    version = cache.code_version([module.__file__ for module in modules])
+    keys = {}
+    for table, path in zip(config["source-tables"], config["raw-data-loc"]):
+        if table not in tables:
+            continue
+        if config["source"] == "api":
+            digest = fetch.snapshot(config)
+        elif hashed:
+            digest = cache.hash_file(path)
+        else:
+            digest = source_state([path])
+        keys[table] = cache.stage_key(
+            digest, config.get("csv-engine"), config[table], version
+        )
+    for table in DERIVED_TABLES:
+        if table not in tables:
+            continue
+        keys[table] = cache.stage_key(
+            *[keys[name] for name in config[table]["inputs"]],
+            config[table],
+            config["anime-stats-scores"],
+            version,
+        )
+    return keys
+
+
+def load_hashes(config: dict, tables: list, keys: dict) -> dict:
+    """
+    Returns the input hash recorded in the run manifest for the load of each of
+    the given tables: its stage cache key and where and how it is loaded
+    """
+    import cache
+
+    history = config["history"]["enabled"]
+    return {
+        table: cache.stage_key(keys[table], config[table], history) for table in tables
+    }
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    """Parses the command line arguments of the ETL process"""
+    parser = argparse.ArgumentParser(
+        description="Loads the MyAnimeList data into the COOP-DA-Database"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="upsert changed rows into the existing tables instead of rebuilding them",
+    )
+    parser.add_argument(
+        "--transform-in-db",
+        action="store_true",
+        help="build the pivoted and joined tables inside the database",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="use_cache",
+        action="store_false",
+        help="recompute every stage instead of reusing the stage cache",
+    )
+    parser.add_argument(
+        "--partitions",
+        type=int,
+        metavar="N",
+        help="run out of core in N hash partitions of the anime (0: in memory)",
+    )
+    parser.add_argument(
+        "--history",
+        action="store_true",
+        help="keep a partition per load date of the history tables (see tables.yml)",
+    )
+    parser.add_argument(
+        "--staged",
+        action="store_true",
+        help="load into a scratch schema and swap the tables in at the end",
+    )
+    parser.add_argument(
+        "--tables",
+        nargs="+",
+        metavar="TABLE",
+        help="only refresh these tables (e.g. anime-votes-pct) and what they need",
+    )
+    parser.add_argument(
+        "--source",
+        choices=["csv", "api"],
+        help="read the raw data from raw-data-loc or fetch it from the API",
+    )
+    parser.add_argument(
+        "--export",
+        dest="export_parquet",
+        action="store_true",
+        help="also export the loaded tables as Parquet files (see tables.yml)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the tables the previous run loaded and retry only the others",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print what would be computed and loaded, without running it",
+    )
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="check tables.yml and exit (non-zero if it has problems)",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="run as a daemon, loading the raw data incrementally when it changes",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="STAGE",
+        help="profile the named stage (e.g. pivot/anime-scores) with cProfile",
+    )
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.validate:
+        found = validate_config(read_config())
+        print("\n".join(found) or f"{CONFIG_PATH} is valid")
+        raise SystemExit(1 if found else 0)
+    run_options = RunOptions(
+        **{
+            field.name: getattr(args, field.name)
+            for field in dataclasses.fields(RunOptions)
+        }
+    )
+    if args.watch:
+        watch(options=run_options)
+    else:
+        main(run_options)
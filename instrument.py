@@ -0,0 +1,240 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Times, measures and profiles the stages of the ETL process and
+              writes a report of each run
+"""
+from datetime import datetime, timezone
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Records of the stages that ran in this process, see call() and drain()
+RECORDS = []
+# Settings from the instrumentation section of tables.yml, see configure()
+OPTIONS = {}
+_LOCK = threading.Lock()
+MB = 1 << 20
+METRICS = {
+    "seconds": "Wall clock time of the stage in seconds",
+    "cpu_seconds": "CPU time of the stage in seconds",
+    "rows_in": "Rows in the DataFrames the stage read",
+    "rows_out": "Rows the stage produced or loaded",
+    "frame_mb_in": "Memory used by the DataFrames the stage read in MiB",
+    "frame_mb": "Memory used by the DataFrames the stage produced in MiB",
+    "peak_rss_mb": "Peak resident set size of the process that ran the stage in MiB",
+}
+
+
+def configure(options: dict):
+    """Applies the instrumentation settings in this process (e.g. a worker)"""
+    OPTIONS.clear()
+    OPTIONS.update(options or {})
+
+
+def peak_rss_mb(children: bool = False):
+    """
+    Returns the peak resident set size of this process, or of the largest of its
+    finished child processes, in MiB. None where it cannot be measured.
+    """
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+def frames_of(value) -> list:
+    """Returns the DataFrames found in an argument or return value"""
+    if isinstance(value, pd.DataFrame):
+        return [value]
+    if isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, (list, tuple)):
+        return []
+    frames = []
+    for item in value:
+        if isinstance(item, pd.DataFrame):
+            frames.append(item)
+        elif isinstance(item, dict):
+            # e.g. the frames keyed by table passed to etl.join_tables
+            frames += frames_of(item)
+    return frames
+
+
+def frames_mb(value):
+    """Returns the memory used by the DataFrames in a value in MiB, if any"""
+    frames = frames_of(value)
+    if not frames:
+        return None
+    return round(sum(df.memory_usage(deep=True).sum() for df in frames) / MB, 1)
+
+
+def count_rows(value):
+    """
+    Returns the rows in a value: the length of its DataFrames, or the row counts
+    returned by the loaders. None when the value holds neither.
+    """
+    frames = frames_of(value)
+    if frames:
+        return sum(len(df) for df in frames)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, dict) and value:
+        if all(isinstance(count, int) for count in value.values()):
+            return sum(value.values())
+    return None
+
+
+def record(entry: dict):
+    """Adds a stage record to this process' run and logs it"""
+    with _LOCK:
+        RECORDS.append(entry)
+    if "error" in entry:
+        logging.error("Stage %s failed after %.2fs", entry["stage"], entry["seconds"])
+        return
+    logging.info(
+        "Stage %s took %.2fs (%.2fs CPU), rows %s -> %s, MB %s -> %s",
+        entry["stage"],
+        entry["seconds"],
+        entry["cpu_seconds"],
+        entry["rows_in"],
+        entry["rows_out"],
+        entry["frame_mb_in"],
+        entry["frame_mb"],
+    )
+
+
+def drain() -> list:
+    """Returns and clears the records of this process, e.g. to send them back"""
+    with _LOCK:
+        records = list(RECORDS)
+        RECORDS.clear()
+    return records
+
+
+def call(stage: str, func, *args, **kwargs):
+    """
+    Runs func(*args, **kwargs) as the named stage, records it and returns its
+    result. The stage named by instrumentation.profile is run under cProfile
+    and its stats are dumped to instrumentation.profile-out.
+    """
+    # Loads run in threads, where only the thread's own CPU time is the stage's
+    main = threading.current_thread() is threading.main_thread()
+    clock = time.process_time if main else time.thread_time
+    profiler = cProfile.Profile() if OPTIONS.get("profile") == stage else None
+    arguments = list(args) + list(kwargs.values())
+    entry = {
+        "stage": stage,
+        "rows_in": count_rows(arguments),
+        "frame_mb_in": frames_mb(arguments),
+    }
+    wall, cpu = time.perf_counter(), clock()
+    try:
+        if profiler is not None:
+            result = profiler.runcall(func, *args, **kwargs)
+        else:
+            result = func(*args, **kwargs)
+    except Exception as err:
+        entry["error"] = repr(err)
+        raise
+    else:
+        entry["rows_out"] = count_rows(result)
+        entry["frame_mb"] = frames_mb(result)
+        return result
+    finally:
+        entry["seconds"] = round(time.perf_counter() - wall, 3)
+        entry["cpu_seconds"] = round(clock() - cpu, 3)
+        entry["peak_rss_mb"] = peak_rss_mb()
+        entry["pid"] = os.getpid()
+        if profiler is not None:
+            profiler.dump_stats(OPTIONS["profile-out"])
+            logging.info("Profile of %s written to %s", stage, OPTIONS["profile-out"])
+        record(entry)
+
+
+def write_atomic(path: str, text: str):
+    """Writes the file through a temporary one so readers never see it partial"""
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        file.write(text)
+    os.replace(f"{path}.tmp", path)
+
+
+def stage_totals(stages: list) -> dict:
+    """
+    Returns the records combined by stage name, for stages that ran several
+    times (e.g. once per partition): the peak RSS is the largest, the other
+    figures are summed
+    """
+    totals = {}
+    for entry in stages:
+        total = totals.setdefault(entry["stage"], {})
+        for metric in METRICS:
+            if entry.get(metric) is None:
+                continue
+            if metric == "peak_rss_mb":
+                total[metric] = max(total.get(metric, 0), entry[metric])
+            else:
+                total[metric] = round(total.get(metric, 0) + entry[metric], 3)
+    return totals
+
+
+def prometheus_text(report: dict) -> str:
+    """Returns the run report in the Prometheus text exposition format"""
+    totals = stage_totals(report["stages"])
+    lines = []
+    for metric, description in METRICS.items():
+        name = f"coop_etl_stage_{metric}"
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+        for stage, total in totals.items():
+            if metric in total:
+                label = stage.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'{name}{{stage="{label}"}} {total[metric]}')
+    run = {
+        "coop_etl_run_seconds": ("Wall clock time of the run", report["seconds"]),
+        "coop_etl_run_success": (
+            "Whether the run succeeded",
+            int(report["status"] == "success"),
+        ),
+        "coop_etl_run_timestamp_seconds": (
+            "When the run finished, in seconds since the epoch",
+            report["timestamp"],
+        ),
+    }
+    for name, (description, value) in run.items():
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_report(options: dict, started: float, status: str) -> dict:
+    """
+    Writes the records of the run that started at @param started (a time.time()
+    timestamp) to the JSON report and the Prometheus textfile configured in
+    @param options, skipping any that is not set. Returns the report.
+    """
+    finished = time.time()
+    report_data = {
+        "started": datetime.fromtimestamp(started, timezone.utc).isoformat(),
+        "finished": datetime.fromtimestamp(finished, timezone.utc).isoformat(),
+        "timestamp": round(finished, 3),
+        "seconds": round(finished - started, 3),
+        "status": status,
+        "peak_rss_mb": peak_rss_mb(),
+        "children_peak_rss_mb": peak_rss_mb(children=True),
+        "stages": drain(),
+    }
+    if options.get("report"):
+        write_atomic(options["report"], json.dumps(report_data, indent=2))
+        logging.info("Run report written to %s", options["report"])
+    if options.get("prometheus"):
+        write_atomic(options["prometheus"], prometheus_text(report_data))
+    return report_data
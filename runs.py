@@ -0,0 +1,90 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Keeps the run manifest of the ETL process in public.etl_runs,
+              which a resumed run (initial_etl.py --resume) reads
+"""
+import logging
+from sqlalchemy import text
+import sql
+
+# Table name of the rows about the run as a whole
+RUN = ""
+
+
+def record(engine, run_id: str, stage: str, status: str, tables: dict, keys: dict):
+    """
+    Records the status of the given stage of each table in @param tables (table
+    -> rows loaded if known, or the exception of failed tables) under its input
+    hash in @param keys
+    """
+    rows = [
+        {
+            "run_id": run_id,
+            "stage": stage,
+            "table_name": table,
+            "input_hash": keys.get(table),
+            "row_count": value if isinstance(value, int) else None,
+            "status": status,
+            "error": repr(value) if isinstance(value, Exception) else None,
+        }
+        for table, value in tables.items()
+    ]
+    if not rows:
+        return
+    with engine.connect() as conn:
+        with conn.begin():
+            conn.execute(text(sql.UPSERT_ETL_RUN), rows)
+
+
+def start(engine, run_id: str):
+    """Creates the run manifest if needed and records the run as running"""
+    with engine.connect() as conn:
+        with conn.begin():
+            conn.execute(text(sql.CREATE_ETL_RUNS))
+    record(engine, run_id, "run", "running", {RUN: 0}, {})
+
+
+def finish(engine, run_id: str, status: str):
+    """Records the final status of the run"""
+    record(engine, run_id, "run", status, {RUN: 0}, {})
+
+
+def completed(engine, run_id: str, stage: str, keys: dict) -> dict:
+    """
+    Returns the rows loaded of each table whose given stage completed in the
+    given run with the same input hash as in @param keys
+    """
+    with engine.connect() as conn:
+        result = conn.execute(
+            text(sql.SELECT_COMPLETED), {"run_id": run_id, "stage": stage}
+        ).fetchall()
+    return {
+        row.table_name: row.row_count
+        for row in result
+        if row.table_name in keys and keys[row.table_name] == row.input_hash
+    }
+
+
+def carry_over(engine, run_id: str, stage: str, keys: dict) -> dict:
+    """
+    Finds the tables of @param keys whose given stage completed in the previous
+    run with the same inputs, and records them as skipped in this run so a later
+    resume skips them too. Returns their rows loaded (table -> rows).
+    """
+    with engine.connect() as conn:
+        previous = conn.execute(
+            text(sql.SELECT_PREVIOUS_RUN), {"run_id": run_id}
+        ).scalar()
+    if previous is None:
+        return {}
+    done = completed(engine, previous, stage, keys)
+    record(engine, run_id, stage, "skipped", done, keys)
+    if done:
+        logging.info(
+            "Skipping %s of %s, completed in run %s",
+            stage,
+            ", ".join(done),
+            previous,
+        )
+    return done
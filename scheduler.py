@@ -0,0 +1,331 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Runs the stages of the ETL process as their inputs are ready,
+              in memory or out of core
+"""
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from functools import partial
+import logging
+import multiprocessing
+import tempfile
+import etl
+import graph
+import cache
+import export
+import fetch
+import instrument
+
+
+def compute_stage(config: dict, stage: dict, inputs: dict) -> dict:
+    """
+    Computes the tables of the given stage from its input DataFrames, or for
+    sources from their raw data files (or, for the fetch stage, from the API)
+    """
+    if stage["transform"] == "clean":
+        return etl.extract_sources(config, stage["paths"])
+    if stage["transform"] == "fetch":
+        batches = fetch.fetch_batches(config, stage["tables"])
+        return etl.clean_batches(config, batches, stage["tables"])
+    if stage["transform"] == "pivot":
+        (source,) = stage["inputs"]
+        pivots = instrument.call(
+            f"pivot/{source}",
+            etl.create_pivot_tables,
+            inputs[source],
+            config,
+            stage["tables"],
+        )
+        return dict(zip(stage["tables"], pivots))
+    return instrument.call("join", etl.join_tables, config, inputs, stage["tables"])
+
+
+def run_stage(
+    config: dict, stage: dict, inputs: dict, stage_cache: dict, keys: dict
+) -> tuple:
+    """
+    Runs a stage in a worker process, going through the stage cache. Returns its
+    DataFrames and the instrumentation records of the worker.
+    """
+    instrument.configure(config["instrumentation"])
+    frames = instrument.call(
+        f"stage/{stage['name']}",
+        cache.cached,
+        stage_cache,
+        {table: keys[table] for table in stage["tables"]},
+        partial(compute_stage, config, stage, inputs),
+    )
+    return frames, instrument.drain()
+
+
+def run_pipeline(
+    config: dict,
+    tables: list,
+    engine,
+    keys: dict,
+    stage_cache: dict = None,
+    incremental: bool = False,
+    targets: list = None,
+) -> dict:
+    """
+    Computes the given tables and loads each one (or only @param targets) as
+    soon as it is ready. Returns the rows loaded per table
+    """
+    options = config["scheduler"]
+    targets = tables if targets is None else targets
+    pending = graph.build_stages(config, tables)
+    frames = {}
+    running = {}
+    loads = {}
+    exports = {}
+    # Spawn rather than fork the workers so that they do not inherit the
+    # engine's open connections
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        options["max-workers"], mp_context=context
+    ) as workers, ThreadPoolExecutor(
+        etl.pool_workers(engine, options["max-connections"])
+    ) as loaders:
+        while pending or running:
+            ready = [
+                stage
+                for stage in pending
+                if all(name in frames for name in stage["inputs"])
+            ]
+            if not ready and not running:
+                missing = {name for stage in pending for name in stage["inputs"]}
+                raise ValueError(f"No stage produces {sorted(missing - set(frames))}")
+            for stage in ready:
+                pending.remove(stage)
+                inputs = {name: frames[name] for name in stage["inputs"]}
+                future = workers.submit(
+                    run_stage, config, stage, inputs, stage_cache, keys
+                )
+                running[future] = stage
+                logging.info("Started stage %s", stage["name"])
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                produced, records = future.result()
+                for entry in records:
+                    instrument.record(entry)
+                frames.update(produced)
+                logging.info("Finished stage %s", stage["name"])
+                for table in stage["tables"]:
+                    if table not in targets:
+                        continue
+                    for load in etl.submit_load(
+                        loaders, frames[table], table, config, engine, incremental
+                    ):
+                        loads[load] = table
+                    exports.update(
+                        submit_exports(loaders, frames, [table], config, engine, 0)
+                    )
+        rows = etl.collect_loads(loads)
+        finish_exports(config, exports, targets)
+        return rows
+
+
+def finish_exports(config: dict, exports: dict, tables: list):
+    """
+    Waits for the export futures of a run (future -> table) and lists the files
+    they wrote in the export manifest, if the export is enabled
+    """
+    if not config["export"]["enabled"]:
+        return
+    export.collect_exports(exports)
+    instrument.call("export/manifest", export.update_manifest, config, tables)
+
+
+def compute_partition(config: dict, stages: list, directory: str, part: int) -> tuple:
+    """
+    Computes the tables of one partition in a worker process: the partition of
+    each source is read back from its spill files and cleaned, then the derived
+    stages run on the cleaned partitions. Returns the DataFrames and the
+    instrumentation records of the worker.
+    """
+    instrument.configure(config["instrumentation"])
+    frames = {}
+    for stage in stages:
+        if stage["transform"] not in ("clean", "fetch"):
+            frames.update(compute_stage(config, stage, frames))
+            continue
+        for table in stage["tables"]:
+            raw = etl.read_spill(directory, table, part)
+            frames[table] = instrument.call(
+                f"clean/{table}", etl.clean_data, raw, config[table]
+            )
+    return frames, instrument.drain()
+
+
+def load_partition(df, table: str, config: dict, engine, incremental: bool) -> int:
+    """
+    Adds a partition to a table created by the first partition: upserting it in
+    incremental mode, appending it otherwise (for history tables, to the day's
+    partition). Returns the rows written.
+    """
+    history = etl.history_column(config, table)
+    if incremental and "dupe-index" in config[table] and not history:
+        return etl.load_table(df, table, config, engine, incremental)
+    return etl.append_table(df, table, config, engine)
+
+
+def submit_exports(
+    executor, frames: dict, tables: list, config: dict, engine, part: int
+):
+    """
+    Submits the export of one partition of the given tables, with their day
+    keys, to the executor if the export is enabled, and returns the futures
+    (future -> table)
+    """
+    if not config["export"]["enabled"]:
+        return {}
+    return {
+        executor.submit(
+            instrument.call,
+            f"export/{table}",
+            etl.export_table,
+            frames[table],
+            table,
+            config,
+            engine,
+            part,
+        ): table
+        for table in tables
+    }
+
+
+def partition_result(future) -> dict:
+    """Returns the DataFrames of a computed partition, recording its stages"""
+    frames, records = future.result()
+    for entry in records:
+        instrument.record(entry)
+    return frames
+
+
+def run_partitioned(
+    config: dict,
+    tables: list,
+    engine,
+    partitions: int,
+    incremental: bool = False,
+    targets: list = None,
+) -> dict:
+    """
+    Computes the given tables one hash partition at a time and loads them (or
+    only @param targets). Rows are loaded in a different order than
+    run_pipeline. Returns the rows loaded per table
+    """
+    options = config["scheduler"]
+    targets = tables if targets is None else targets
+    stages = graph.build_stages(config, tables)
+    with tempfile.TemporaryDirectory(
+        dir=config["partitioned"].get("spill-dir")
+    ) as directory:
+        for stage in stages:
+            if stage["transform"] == "fetch":
+                instrument.call(
+                    "spill/fetch",
+                    etl.spill_batches,
+                    config,
+                    fetch.fetch_batches(config, stage["tables"]),
+                    stage["tables"],
+                    directory,
+                    partitions,
+                )
+            for table, path in stage["paths"].items():
+                instrument.call(
+                    f"spill/{table}",
+                    etl.spill_source,
+                    config,
+                    table,
+                    path,
+                    directory,
+                    partitions,
+                )
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            options["max-workers"], mp_context=context
+        ) as workers, ThreadPoolExecutor(
+            etl.pool_workers(engine, options["max-connections"])
+        ) as loaders:
+            frames = partition_result(
+                workers.submit(compute_partition, config, stages, directory, 0)
+            )
+            first = {
+                loaders.submit(
+                    instrument.call,
+                    f"load/{table}",
+                    etl.load_table,
+                    frames[table],
+                    table,
+                    config,
+                    engine,
+                    incremental,
+                ): table
+                for table in targets
+            }
+            exports = submit_exports(loaders, frames, targets, config, engine, 0)
+            try:
+                rows = etl.collect_loads(first)
+            except etl.LoadError as err:
+                # The other partitions of the tables that did load are not loaded
+                raise etl.LoadError(err.errors) from err
+            logging.info("Loaded partition 1 of %s", partitions)
+            pending = list(range(1, partitions))
+            running = {}
+            loading = {}
+            loads = {}
+            while pending or running:
+                loading = {
+                    part: futures
+                    for part, futures in loading.items()
+                    if not all(future.done() for future in futures)
+                }
+                while pending and len(running) + len(loading) < options["max-workers"]:
+                    part = pending.pop(0)
+                    future = workers.submit(
+                        compute_partition, config, stages, directory, part
+                    )
+                    running[future] = part
+                waiting = list(running)
+                for futures in loading.values():
+                    waiting += futures
+                done, _ = wait(waiting, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future not in running:
+                        continue
+                    part = running.pop(future)
+                    frames = partition_result(future)
+                    loading[part] = [
+                        loaders.submit(
+                            instrument.call,
+                            f"load/{table}",
+                            load_partition,
+                            frames[table],
+                            table,
+                            config,
+                            engine,
+                            incremental,
+                        )
+                        for table in targets
+                    ]
+                    loads.update(zip(loading[part], targets))
+                    exports.update(
+                        submit_exports(loaders, frames, targets, config, engine, part)
+                    )
+                    logging.info("Computed partition %s of %s", part + 1, partitions)
+            try:
+                later = etl.collect_loads(loads)
+            except etl.LoadError as err:
+                loaded = {table: rows[table] + n for table, n in err.rows.items()}
+                raise etl.LoadError(err.errors, loaded) from err
+            for table, count in later.items():
+                rows[table] += count
+            finish_exports(config, exports, targets)
+    return rows
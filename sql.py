@@ -7,7 +7,11 @@ CREATE_SCHEMA = """
     DROP SCHEMA IF EXISTS anime CASCADE;
     CREATE SCHEMA IF NOT EXISTS anime;
 """
-# Dim Day
+# Create Schema without dropping existing tables (incremental loads)
+ENSURE_SCHEMA = """
+    CREATE SCHEMA IF NOT EXISTS anime;
+"""
+# Dim Day (see dimensions.py)
 CREATE_DIM_DAY = """
     CREATE TABLE IF NOT EXISTS public.dim_day (
         day_key SERIAL,
@@ -28,6 +32,9 @@ CREATE_DIM_DAY = """
         PRIMARY KEY (day_key)
     );
 
+    CREATE INDEX IF NOT EXISTS idx_date ON public.dim_day(_date);
+"""
+RESET_DIM_DAY = """
     TRUNCATE TABLE public.dim_day RESTART IDENTITY;
 
     -- Insert NULL row
@@ -42,8 +49,10 @@ CREATE_DIM_DAY = """
             NULL, NULL, NULL, NULL, NULL, NULL, NULL, 
             NULL
     );
-
-    -- Insert Dim_Day
+"""
+# Inserts the days from {start} to {end}, both included. The day of the quarter
+# is computed from the date alone so that any range can be appended.
+INSERT_DIM_DAY = """
     INSERT INTO public.dim_day(
         _date, day_of_month, month_num, quarter, _year, 
         month_name, day_of_week, day_of_year, week_of_year, 
@@ -76,8 +85,8 @@ CREATE_DIM_DAY = """
         AS week_of_year
     FROM
         GENERATE_SERIES
-            ('1970-01-01'::DATE
-            ,'2050-01-01'::DATE,'1 Day')
+            ('{start}'::DATE
+            ,'{end}'::DATE,'1 Day')
         AS series(day)
     )
     SELECT
@@ -90,13 +99,9 @@ CREATE_DIM_DAY = """
         ,day_of_week
         ,day_of_year
         ,week_of_year
-        ,ROW_NUMBER() OVER
-        (PARTITION BY
-            quarter
-            ,_year
-        ORDER BY
-            _date
-        )
+        ,_date
+        - MAKE_DATE(_year::INT,(quarter::INT - 1) * 3 + 1,1)
+        + 1
         AS day_of_quarter
         ,TO_CHAR((MAKE_DATE(_year::INT,month_num::INT,1))::DATE
                 ,'Day')
@@ -117,13 +122,252 @@ CREATE_DIM_DAY = """
         dim_day
     ORDER BY
         date_key;
-        
-    CREATE INDEX IF NOT EXISTS idx_date ON public.dim_day(_date);
+"""
+# Day keys of the dates in dim_day, and of its NULL row
+SELECT_DIM_DAY_KEYS = """
+    SELECT _date, day_key
+    FROM public.dim_day
+    WHERE _date <> '1000-12-31'
+    ORDER BY _date;
+"""
+SELECT_DIM_DAY_NULL_KEY = """
+    SELECT day_key
+    FROM public.dim_day
+    WHERE _date = '1000-12-31';
+"""
+# The day_key of a date column of a table built in the database, the NULL
+# row's for missing dates and dates outside dim_day
+DAY_KEY_COLUMN = """COALESCE({alias}.day_key, (
+            SELECT day_key FROM public.dim_day WHERE _date = '1000-12-31'
+        )) AS {key}"""
+DAY_KEY_JOIN = (
+    """LEFT JOIN public.dim_day AS {alias} ON {alias}._date = ({column})::DATE"""
+)
+# Dates are taken on their UTC day, like add_day_keys does
+SET_UTC_TIME_ZONE = """
+    SET LOCAL TIME ZONE 'UTC';
+"""
+
+# Fingerprints and date ranges of the dimension tables (see dimensions.py)
+CREATE_ETL_METADATA = """
+    CREATE TABLE IF NOT EXISTS public.etl_metadata (
+        name TEXT PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        range_start DATE,
+        range_end DATE,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    );
+"""
+SELECT_ETL_METADATA = """
+    SELECT fingerprint, range_start, range_end
+    FROM public.etl_metadata
+    WHERE name = :name;
+"""
+UPSERT_ETL_METADATA = """
+    INSERT INTO public.etl_metadata (name, fingerprint, range_start, range_end)
+    VALUES (:name, :fingerprint, :range_start, :range_end)
+    ON CONFLICT (name) DO UPDATE SET
+        fingerprint = EXCLUDED.fingerprint,
+        range_start = EXCLUDED.range_start,
+        range_end = EXCLUDED.range_end,
+        updated_at = NOW();
+"""
+
+# Run manifest (see runs.py): the status of every stage of every table in each run
+CREATE_ETL_RUNS = """
+    CREATE TABLE IF NOT EXISTS public.etl_runs (
+        run_id TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        table_name TEXT NOT NULL,
+        input_hash TEXT,
+        row_count BIGINT,
+        status TEXT NOT NULL,
+        error TEXT,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (run_id, stage, table_name)
+    );
+"""
+UPSERT_ETL_RUN = """
+    INSERT INTO public.etl_runs
+        (run_id, stage, table_name, input_hash, row_count, status, error)
+    VALUES (:run_id, :stage, :table_name, :input_hash, :row_count, :status, :error)
+    ON CONFLICT (run_id, stage, table_name) DO UPDATE SET
+        input_hash = EXCLUDED.input_hash,
+        row_count = EXCLUDED.row_count,
+        status = EXCLUDED.status,
+        error = EXCLUDED.error,
+        updated_at = NOW();
+"""
+SELECT_PREVIOUS_RUN = """
+    SELECT run_id
+    FROM public.etl_runs
+    WHERE stage = 'run' AND run_id <> :run_id
+    ORDER BY run_id DESC
+    LIMIT 1;
+"""
+SELECT_COMPLETED = """
+    SELECT table_name, input_hash, row_count
+    FROM public.etl_runs
+    WHERE run_id = :run_id AND stage = :stage AND status IN ('success', 'skipped');
+"""
+
+# In-database transforms (initial_etl.py --transform-in-db)
+# Pivots the source table with tablefunc's crosstab(), one column per category
+CREATE_PIVOT_TABLE = """
+    DROP TABLE IF EXISTS {schema}.{tablename};
+    CREATE {unlogged}TABLE {schema}.{tablename} AS
+    SELECT
+        {columns}
+    FROM crosstab(
+        'SELECT {index}, {pivot_on}, {values} FROM {source} ORDER BY 1, 2'
+        ,'VALUES {categories}'
+    ) AS ct({index} {index_type}, {value_types})
+    {day_joins};
+"""
+# Inner joins the input tables on their shared key
+CREATE_JOINED_TABLE = """
+    DROP TABLE IF EXISTS {schema}.{tablename};
+    CREATE {unlogged}TABLE {schema}.{tablename} AS
+    SELECT
+        {columns}
+    FROM {base} AS t0
+    {joins}
+    {day_joins};
 """
 
-# Metadata
-ADD_METADATA = """
-        -- Anime Stats and Scores Raw
+# Keys and indexes (see tables.yml), built after the tables are loaded
+SET_MAINTENANCE_WORK_MEM = """
+    SET LOCAL maintenance_work_mem = '{memory}';
+"""
+ADD_PRIMARY_KEY = """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_constraint
+            WHERE conrelid = '{schema}.{tablename}'::REGCLASS AND contype = 'p'
+        ) THEN
+            ALTER TABLE {schema}.{tablename}
+                ADD CONSTRAINT "{name}" PRIMARY KEY ({columns});
+        END IF;
+    END $$;
+"""
+CREATE_INDEX = """
+    CREATE {unique}INDEX IF NOT EXISTS "{name}" ON {schema}.{tablename} ({columns});
+"""
+
+# History mode (see etl.load_history): tables range-partitioned on a date column,
+# with one partition per day that is built off-line and then attached
+PARTITION_BY_RANGE = """ PARTITION BY RANGE ({column});
+"""
+SELECT_RELATION_KIND = """
+    SELECT pg_class.relkind
+    FROM pg_class
+    JOIN pg_namespace ON pg_namespace.oid = pg_class.relnamespace
+    WHERE pg_namespace.nspname = %s AND pg_class.relname = %s;
+"""
+SELECT_PARTITIONS = """
+    SELECT child.relname
+    FROM pg_inherits
+    JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent
+    JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+    JOIN pg_namespace ON pg_namespace.oid = parent.relnamespace
+    WHERE pg_namespace.nspname = %s AND parent.relname = %s
+    ORDER BY child.relname;
+"""
+# The CHECK constraint matches the partition's bounds, so that ATTACH PARTITION
+# does not have to scan the new partition to validate them
+CREATE_PARTITION_STAGE = """
+    DROP TABLE IF EXISTS {schema}.{stage};
+    CREATE TABLE {schema}.{stage} (
+        LIKE {schema}.{tablename} INCLUDING DEFAULTS
+        ,CONSTRAINT "{stage}_bounds" CHECK (
+            {column} IS NOT NULL AND {column} >= '{start}' AND {column} < '{end}'
+        )
+    );
+"""
+# Swaps the staged partition in for the day, renaming its indexes after it
+ATTACH_PARTITION = """
+    DROP TABLE IF EXISTS {schema}.{partition};
+    ALTER TABLE {schema}.{stage} RENAME TO {partition};
+    DO $$
+    DECLARE
+        index_name TEXT;
+    BEGIN
+        FOR index_name IN
+            SELECT indexname FROM pg_indexes
+            WHERE schemaname = '{schema}' AND tablename = '{partition}'
+        LOOP
+            EXECUTE FORMAT(
+                'ALTER INDEX {schema}.%I RENAME TO %I'
+                ,index_name
+                ,REPLACE(index_name, '{stage}', '{partition}')
+            );
+        END LOOP;
+    END $$;
+    ALTER TABLE {schema}.{tablename} ATTACH PARTITION {schema}.{partition}
+        FOR VALUES FROM ('{start}') TO ('{end}');
+    ALTER TABLE {schema}.{partition} DROP CONSTRAINT "{stage}_bounds";
+"""
+DETACH_PARTITION = """
+    ALTER TABLE {schema}.{tablename} DETACH PARTITION {schema}.{partition};
+"""
+DROP_PARTITION = """
+    DROP TABLE {schema}.{partition};
+"""
+
+# Staged loads (see etl.swap_staged): tables are loaded unlogged into a scratch
+# schema, then moved into place in a single transaction
+# Row ranges of a large table are loaded in parallel into {scratch}, which then
+# replaces the table, or is dropped if any range failed
+RENAME_LOADED_TABLE = """
+    DROP TABLE IF EXISTS {schema}.{tablename};
+    ALTER TABLE {schema}.{scratch} RENAME TO {tablename};
+"""
+DROP_LOADED_TABLE = """
+    DROP TABLE IF EXISTS {schema}.{scratch};
+"""
+CREATE_STAGING_SCHEMA = """
+    DROP SCHEMA IF EXISTS {schema} CASCADE;
+    CREATE SCHEMA {schema};
+"""
+SET_LOGGED = """
+    ALTER TABLE {schema}.{tablename} SET LOGGED;
+"""
+SET_LOCK_TIMEOUT = """
+    SET LOCAL lock_timeout = '{timeout}';
+"""
+SWAP_TABLE = """
+    DROP TABLE IF EXISTS {schema}.{tablename};
+    ALTER TABLE {staging}.{tablename} SET SCHEMA {schema};
+"""
+# Views (and materialized views) reading any of the given tables, which the
+# swap would have to drop with them
+SELECT_DEPENDENT_VIEWS = """
+    SELECT DISTINCT dependent.oid::regclass::text AS view_name,
+        source.oid::regclass::text AS table_name
+    FROM pg_depend dep
+    JOIN pg_rewrite rule ON rule.oid = dep.objid
+    JOIN pg_class dependent ON dependent.oid = rule.ev_class
+    JOIN pg_class source ON source.oid = dep.refobjid
+    WHERE dep.classid = 'pg_rewrite'::regclass
+        AND dep.refclassid = 'pg_class'::regclass
+        AND dependent.oid <> source.oid
+        AND source.oid IN (
+            SELECT to_regclass(name) FROM unnest(CAST(:tables AS TEXT[])) AS name
+        );
+"""
+# Resumed staged runs keep the tables their previous run staged
+ENSURE_STAGING_SCHEMA = """
+    CREATE SCHEMA IF NOT EXISTS {schema};
+"""
+DROP_STAGING_SCHEMA = """
+    DROP SCHEMA IF EXISTS {schema} CASCADE;
+"""
+
+# Metadata of each table, by schema.tablename
+METADATA = {
+    # Anime Stats and Scores Raw
+    "anime.anime_stats_and_scores_raw": """
     COMMENT ON TABLE anime.anime_stats_and_scores_raw
         IS '''A listing of all animes with their respective statistics and scores from MyAnimeList. 
             Columns 1-10 denote the number of raw votes for each respective score''';
@@ -174,8 +418,10 @@ ADD_METADATA = """
         IS 'Number of users who have planned to watch the resource';
 
     COMMENT ON COLUMN anime.anime_stats_and_scores_raw.total
-        IS 'Total number of users who have the resource added to their lists'; 
-    -- Anime Stats and Scores Percentage
+        IS 'Total number of users who have the resource added to their lists';
+""",
+    # Anime Stats and Scores Percentage
+    "anime.anime_stats_and_scores_pct": """
     COMMENT ON TABLE anime.anime_stats_and_scores_pct
         IS '''A listing of all animes with their respective statistics and scores from MyAnimeList. 
             Columns 1-10 denote the percentage of votes given for each respective score for that anime.''';
@@ -226,8 +472,10 @@ ADD_METADATA = """
         IS 'Number of users who have planned to watch the resource';
 
     COMMENT ON COLUMN anime.anime_stats_and_scores_pct.total
-        IS 'Total number of users who have the resource added to their lists'; 
-    -- All Anime 
+        IS 'Total number of users who have the resource added to their lists';
+""",
+    # All Anime
+    "anime.all_anime": """
     COMMENT ON TABLE anime.all_anime
         IS 'All suitable for work anime titles from My Anime List';
 
@@ -257,7 +505,9 @@ ADD_METADATA = """
 
     COMMENT ON COLUMN anime.all_anime.aired_to
         IS 'Date that anime stopped airing if off the air';
-    -- Anime Scores
+""",
+    # Anime Scores
+    "anime.scores": """
     COMMENT ON COLUMN anime.scores.anime_id
         IS 'The id of the anime';
 
@@ -272,8 +522,9 @@ ADD_METADATA = """
 
     COMMENT ON COLUMN anime.scores.load_date
         IS 'Date/time that scores were extracted and loaded';
-
-    -- Anime Stats
+""",
+    # Anime Stats
+    "anime.stats": """
     COMMENT ON COLUMN anime.stats.anime_id
         IS 'The id of the anime';
 
@@ -296,16 +547,14 @@ ADD_METADATA = """
         IS 'Total number of users who have the resource added to their lists';
 
     COMMENT ON COLUMN anime.stats.load_date
-        IS 'Date/time that stats were extracted and loaded';    
-"""
+        IS 'Date/time that stats were extracted and loaded';
+""",
+}
+# Metadata of every table
+ADD_METADATA = "".join(METADATA.values())
 
 
-# Analyzing Columns Statistics
-ANALYZE_COLUMN_STATS = """
-    ANALYZE public.dim_day;
-    ANALYZE anime.all_anime;
-    ANALYZE anime.stats;
-    ANALYZE anime.scores;
-    ANALYZE anime.anime_stats_and_scores_raw;
-    ANALYZE anime.anime_stats_and_scores_pct;
+# Analyzing Columns Statistics of a table whose content changed
+ANALYZE_TABLE = """
+    ANALYZE {table};
 """
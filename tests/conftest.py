@@ -0,0 +1,20 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Shared fixtures of the tests of the ETL process, which import
+              its modules from the repository root
+"""
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import initial_etl  # pylint: disable=wrong-import-position
+
+
+@pytest.fixture
+def config() -> dict:
+    """Returns the configuration and table definitions in tables.yml"""
+    return initial_etl.read_config(os.path.join(ROOT, initial_etl.CONFIG_PATH))
@@ -0,0 +1,111 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Tests of the stage cache (cache.py)
+"""
+import os
+import warnings
+import pandas as pd
+import pyarrow as pa
+import pytest
+import cache
+import etl
+import initial_etl
+
+
+def test_code_version_covers_every_pipeline_module(config, monkeypatch):
+    hashed = []
+    monkeypatch.setattr(
+        cache, "hash_file", lambda path: hashed.append(path) or "digest"
+    )
+    initial_etl.stage_keys(config, ["all-anime"])
+    for module in ["cache", "etl", "fetch", "graph", "scheduler"]:
+        assert any(path.endswith(f"{module}.py") for path in hashed), module
+
+
+def test_code_version_changes_with_the_libraries(monkeypatch):
+    paths = [etl.__file__]
+    version = cache.code_version(paths)
+    assert cache.code_version(paths) == version
+    monkeypatch.setattr(pd, "__version__", "0.0.0")
+    assert cache.code_version(paths) != version
+    monkeypatch.undo()
+    monkeypatch.setattr(pa, "__version__", "0.0.0")
+    assert cache.code_version(paths) != version
+
+
+def entries(directory) -> list:
+    """Returns the keys of the entries in the cache directory"""
+    return sorted(name[: -len(".arrow")] for name in os.listdir(directory))
+
+
+def fill(directory, keys: list) -> int:
+    """Stores an entry per key, each used after the previous one. Returns its size"""
+    df = pd.DataFrame({"a": range(1000)})
+    for age, key in enumerate(keys):
+        cache.store(str(directory), key, df)
+        used = 1000 + age
+        os.utime(cache.entry_path(str(directory), key), (used, used))
+    return os.path.getsize(cache.entry_path(str(directory), keys[0]))
+
+
+def test_evict_removes_the_least_recently_used_entries(tmp_path):
+    size = fill(tmp_path, ["a", "b", "c", "d"])
+    cache.evict(str(tmp_path), 2 * size)
+    assert entries(tmp_path) == ["c", "d"]
+
+
+def test_evict_keeps_a_cache_that_fits(tmp_path):
+    size = fill(tmp_path, ["a", "b"])
+    cache.evict(str(tmp_path), 2 * size)
+    assert entries(tmp_path) == ["a", "b"]
+
+
+def test_loading_an_entry_keeps_it_from_eviction(tmp_path):
+    size = fill(tmp_path, ["a", "b", "c"])
+    assert cache.load(str(tmp_path), "a") is not None
+    cache.evict(str(tmp_path), 2 * size)
+    assert entries(tmp_path) == ["a", "c"]
+
+
+def test_cached_evicts_after_storing(tmp_path):
+    size = fill(tmp_path, ["a", "b"])
+    options = {"dir": str(tmp_path), "max-size-mb": 2 * size / (1 << 20)}
+    frames = cache.cached(
+        options, {"t": "c"}, lambda: {"t": pd.DataFrame({"a": range(1000)})}
+    )
+    assert list(frames["t"]["a"]) == list(range(1000))
+    assert entries(tmp_path) == ["b", "c"]
+    # A hit is read back from the cache without computing it again
+    again = cache.cached(options, {"t": "c"}, lambda: pytest.fail("recomputed"))
+    pd.testing.assert_frame_equal(again["t"], frames["t"])
+
+
+def test_evict_skips_entries_another_worker_removed(tmp_path, monkeypatch):
+    size = fill(tmp_path, ["a", "b", "c"])
+    listdir = os.listdir
+    # An entry listed, then evicted by another worker before it is looked at
+    monkeypatch.setattr(os, "listdir", lambda path: listdir(path) + ["gone.arrow"])
+    remove = os.remove
+
+    def race(path):
+        # Another worker removes the oldest entry first
+        remove(path)
+        if path.endswith("a.arrow"):
+            raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, "remove", race)
+    cache.evict(str(tmp_path), size)
+    monkeypatch.undo()
+    assert entries(tmp_path) == ["c"]
+    assert cache.load(str(tmp_path), "a") is None
+
+
+def test_store_keeps_mixed_column_labels_without_warning(tmp_path):
+    df = pd.DataFrame({"anime_id": [1, 2], 1: [0.5, 0.25], 2: [0.5, 0.75]})
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        cache.store(str(tmp_path), "pivot", df)
+    loaded = cache.load(str(tmp_path), "pivot")
+    assert list(loaded.columns) == ["anime_id", 1, 2]
+    pd.testing.assert_frame_equal(loaded, df)
@@ -0,0 +1,126 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Tests that the tables built in the database (--transform-in-db)
+              get the same day keys, in the same columns, as add_day_keys
+"""
+import os
+import re
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+import dimensions
+import etl
+import initial_etl
+
+SCHEMA = "etl_test"
+
+
+def sql_columns(query: str) -> list:
+    """Returns the names of the columns a CREATE TABLE ... AS SELECT selects"""
+    select = query.split("SELECT", 1)[1].split("\n    FROM", 1)[0]
+    names = []
+    for item in select.split("\n        ,"):
+        alias = re.search(r"AS \"?(\w+)\"?$", item.strip())
+        names.append(alias.group(1) if alias else item.strip().strip('"'))
+    return names
+
+
+@pytest.mark.parametrize("table", initial_etl.DERIVED_TABLES)
+def test_day_keys_follow_their_dates_like_add_day_keys(config, table, monkeypatch):
+    dates = pd.DatetimeIndex(["2022-06-27"])
+    monkeypatch.setattr(etl, "dim_day_keys", lambda engine: (dates, np.array([2]), 1))
+    definition = config[table]
+    columns = (
+        definition["columns"]
+        if definition["transform"] == "pivot"
+        else config["anime-stats-scores"]["columns"]
+    )
+    df = pd.DataFrame({col: [pd.Timestamp("2022-06-27")] for col in columns})
+    expected = etl.add_day_keys(df, definition["day-keys"], None).columns
+    builders = {"pivot": etl.pivot_sql, "join": etl.join_sql}
+    query = builders[definition["transform"]](config, table)
+    assert sql_columns(query) == [str(col) for col in expected]
+
+
+@pytest.fixture
+def database(config):
+    """
+    Returns a connection to the Postgres database at ETL_TEST_DATABASE_URL, in
+    a session time zone other than UTC, with dim_day built and a scratch schema
+    """
+    url = os.environ.get("ETL_TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("ETL_TEST_DATABASE_URL is not set")
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        dimensions.ensure_dim_day(conn, config["dim-day"])
+        with conn.begin():
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        conn.execute(text("SET TIME ZONE 'America/New_York'"))
+        yield conn
+        with conn.begin():
+            conn.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+    engine.dispose()
+
+
+def test_joined_day_keys_match_add_day_keys(config, database):
+    for table in ["all-anime", "anime-votes-raw", "anime-stats"]:
+        config[table]["schema"] = SCHEMA
+    table = "anime-stats-scores-raw"
+    config[table]["schema"] = SCHEMA
+    load_date = pd.to_datetime(["2022-06-27", "2022-06-27", "2022-06-27"])
+    pd.DataFrame(
+        {
+            "anime_id": [1, 2, 3],
+            "load_date": load_date,
+            "anime_title": ["a", "b", "c"],
+            "status": "Finished Airing",
+            "rating": "G - All Ages",
+            "score": 7.0,
+            "favorites": 1,
+            "airing": False,
+            # Early in the UTC day, so still the day before in New York
+            "aired_from": pd.to_datetime(
+                ["2022-01-01T02:00:00Z", "2021-12-31T23:00:00Z", None]
+            ),
+            # After the end of dim_day
+            "aired_to": pd.to_datetime([None, "2060-01-01T00:00:00Z", None]),
+        }
+    ).to_sql("all_anime", database, schema=SCHEMA, index=False)
+    votes = pd.DataFrame({"anime_id": [1, 2, 3], "load_date": load_date})
+    votes[[str(score) for score in range(1, 11)]] = 1
+    votes.to_sql("anime_votes_raw", database, schema=SCHEMA, index=False)
+    pd.DataFrame(
+        {
+            "anime_id": [1, 2, 3],
+            "watching": 1,
+            "completed": 1,
+            "on_hold": 1,
+            "dropped": 1,
+            "plan_to_watch": 1,
+            "total": 5,
+            "load_date": load_date,
+        }
+    ).to_sql("stats", database, schema=SCHEMA, index=False)
+    etl.build_in_database(database, config, table)
+    built = pd.read_sql(
+        f"SELECT * FROM {SCHEMA}.{config[table]['tablename']} ORDER BY anime_id",
+        database,
+    )
+    keys = [f"{col}_key" for col in config[table]["day-keys"]]
+    expected = etl.add_day_keys(
+        built.drop(columns=keys), config[table]["day-keys"], database
+    )
+    assert list(built.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(
+        built[keys], expected[keys].astype("int64"), check_dtype=False
+    )
+    # Taken on the UTC day, not the session's
+    days = pd.read_sql(
+        "SELECT day_key, _date FROM public.dim_day", database, index_col="day_key"
+    )["_date"]
+    assert str(days[built["aired_from_key"].iloc[0]]) == "2022-01-01"
+    assert str(days[built["aired_from_key"].iloc[1]]) == "2021-12-31"
@@ -0,0 +1,44 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Tests of the dimension tables (dimensions.py)
+"""
+from datetime import date
+import pytest
+import dimensions
+
+STORED = (date(2022, 1, 10), date(2022, 1, 20))
+
+
+@pytest.mark.parametrize(
+    "start, end, expected",
+    [
+        # Covered, including its bounds
+        (date(2022, 1, 10), date(2022, 1, 20), []),
+        (date(2022, 1, 12), date(2022, 1, 15), []),
+        # Grown at either end or both
+        (date(2022, 1, 5), date(2022, 1, 20), [(date(2022, 1, 5), date(2022, 1, 9))]),
+        (
+            date(2022, 1, 10),
+            date(2022, 1, 25),
+            [(date(2022, 1, 21), date(2022, 1, 25))],
+        ),
+        (
+            date(2022, 1, 1),
+            date(2022, 1, 31),
+            [
+                (date(2022, 1, 1), date(2022, 1, 9)),
+                (date(2022, 1, 21), date(2022, 1, 31)),
+            ],
+        ),
+        # Entirely before or after the stored range
+        (date(2022, 1, 1), date(2022, 1, 3), [(date(2022, 1, 1), date(2022, 1, 3))]),
+        (
+            date(2022, 2, 1),
+            date(2022, 2, 3),
+            [(date(2022, 2, 1), date(2022, 2, 3))],
+        ),
+    ],
+)
+def test_missing_ranges(start, end, expected):
+    assert dimensions.missing_ranges(*STORED, start, end) == expected
@@ -0,0 +1,36 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Tests that the exported Parquet files (export.py) hold the same
+              columns as the loaded tables
+"""
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import etl
+
+
+def test_exports_have_the_day_keys_of_the_loaded_table(config, tmp_path, monkeypatch):
+    dates = pd.DatetimeIndex(["2022-06-26", "2022-06-27"])
+    monkeypatch.setattr(
+        etl, "dim_day_keys", lambda engine: (dates, np.array([5, 6]), 1)
+    )
+    config["export"].update(dir=str(tmp_path), run="20220627T000000")
+    df = pd.DataFrame(
+        {
+            "anime_id": [1, 2],
+            "load_date": pd.to_datetime(["2022-06-27", "2022-06-27"]),
+            "score": [1, 2],
+            "votes": [10, 20],
+            "percentage": [50.0, 50.0],
+        }
+    )
+    assert etl.export_table(df, "anime-scores", config, None) == 2
+    directory = os.path.join(str(tmp_path), config["anime-scores"]["tablename"])
+    exported = pq.read_table(
+        os.path.join(directory, "load_date=2022-06-27", "20220627T000000-0000.parquet")
+    ).to_pandas()
+    loaded = etl.with_day_keys(df, "anime-scores", config, None)
+    assert list(exported.columns) == list(loaded.columns)
+    assert list(exported["load_date_key"]) == [6, 6]
@@ -0,0 +1,266 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Tests of the API fetch (fetch.py) against a stub of the Jikan
+              API served by aiohttp on a background thread
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from aiohttp import web
+import pandas as pd
+import pytest
+import etl
+import fetch
+
+SOURCES = ["all-anime", "anime-stats", "anime-scores"]
+
+
+class StubApi:
+    """
+    Serves @param pages pages of @param per_page anime and their statistics,
+    recording every request. The statistics of the anime in @param throttled
+    (anime id -> count) are answered with that many 429s first.
+    """
+
+    def __init__(self, pages: int = 3, per_page: int = 2, throttled: dict = None):
+        self.pages = pages
+        self.per_page = per_page
+        self.throttled = dict(throttled or {})
+        self.retry_after = None
+        self.requests = []
+
+    async def anime(self, request):
+        """Returns a page of the anime listing"""
+        page = int(request.query["page"])
+        self.requests.append(("anime", page, time.monotonic()))
+        first = (page - 1) * self.per_page + 1
+        data = [
+            {
+                "mal_id": i,
+                "title": f"Anime {i}",
+                "status": "Finished Airing",
+                "rating": "PG-13 - Teens 13 or older",
+                "score": 7.5,
+                "favorites": i,
+                "airing": False,
+                "aired": {"from": "2020-01-01T00:00:00+00:00", "to": None},
+            }
+            for i in range(first, first + self.per_page)
+        ]
+        return web.json_response(
+            {"data": data, "pagination": {"has_next_page": page < self.pages}}
+        )
+
+    async def statistics(self, request):
+        """Returns the statistics of an anime, or a 429 while it is throttled"""
+        mal_id = int(request.match_info["mal_id"])
+        self.requests.append(("statistics", mal_id, time.monotonic()))
+        if self.throttled.get(mal_id):
+            self.throttled[mal_id] -= 1
+            headers = {"Retry-After": self.retry_after} if self.retry_after else {}
+            return web.Response(status=429, headers=headers)
+        stats = {
+            "watching": mal_id,
+            "completed": 2,
+            "on_hold": 3,
+            "dropped": 4,
+            "plan_to_watch": 5,
+            "total": mal_id + 14,
+            "scores": [
+                {"score": score, "votes": score * mal_id, "percentage": 10.0}
+                for score in range(1, 11)
+            ],
+        }
+        return web.json_response({"data": stats})
+
+    def fetched(self, kind: str) -> list:
+        """Returns the pages or anime ids requested of the given kind, in order"""
+        return [key for name, key, _ in self.requests if name == kind]
+
+
+@pytest.fixture
+def api():
+    """Runs a StubApi on a free port and returns it with its base URL"""
+    stub = StubApi()
+    app = web.Application()
+    app.add_routes(
+        [
+            web.get("/anime", stub.anime),
+            web.get("/anime/{mal_id}/statistics", stub.statistics),
+        ]
+    )
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", 0).start())
+    host, port = runner.addresses[0][:2]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield stub, f"http://{host}:{port}"
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.run_until_complete(runner.cleanup())
+    loop.close()
+
+
+@pytest.fixture
+def api_config(config, api, tmp_path):
+    """Returns the configuration with its API options pointing at the stub"""
+    _, url = api
+    config["source"] = "api"
+    config["api"] = {
+        "base-url": url,
+        "page-size": 2,
+        "max-pages": None,
+        "rate": 1000,
+        "burst": 1000,
+        "concurrency": 4,
+        "retries": 3,
+        "backoff": 0.05,
+        "timeout": 10,
+        "state-dir": str(tmp_path / "state"),
+    }
+    return config
+
+
+def read_cursor(config: dict) -> dict:
+    """Returns the cursor the fetch left in its state directory"""
+    path = os.path.join(config["api"]["state-dir"], "cursor.json")
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def test_pages_are_yielded_as_they_arrive(api, api_config):
+    stub, _ = api
+    batches = fetch.fetch_batches(api_config, SOURCES)
+    first = next(batches)
+    # The first page is cleaned before the next one is even requested
+    assert stub.fetched("anime") == [1]
+    assert list(first["all-anime"]["id"]) == [1, 2]
+    rest = list(batches)
+    assert stub.fetched("anime") == [1, 2, 3]
+    pages = [first] + rest
+    assert [list(page["all-anime"]["id"]) for page in pages] == [[1, 2], [3, 4], [5, 6]]
+    assert all(len(page["anime-scores"]) == 20 for page in pages)
+    # Typed by the csv-schema like the raw CSVs
+    all_anime = pages[0]["all-anime"]
+    assert all_anime["status"].dtype == "category"
+    assert pd.api.types.is_datetime64_any_dtype(all_anime["load_date"])
+    assert read_cursor(api_config)["next-page"] is None
+
+
+def test_batches_are_cleaned_like_the_whole_data(api_config):
+    cleaned = etl.clean_batches(
+        api_config, fetch.fetch_batches(api_config, SOURCES), SOURCES
+    )
+    for table in SOURCES:
+        # The pages were stored by the fetch, so this reads them back
+        raw = etl.concat_chunks(
+            [page[table] for page in fetch.fetch_batches(api_config, [table])]
+        )
+        expected = etl.clean_data(raw, api_config[table])
+        pd.testing.assert_frame_equal(cleaned[table], expected)
+
+
+def test_throttled_requests_are_retried_after_retry_after(api, api_config):
+    stub, _ = api
+    stub.throttled = {3: 1}
+    stub.retry_after = "0.2"
+    pages = list(fetch.fetch_batches(api_config, SOURCES))
+    assert stub.fetched("statistics").count(3) == 2
+    times = [at for name, key, at in stub.requests if (name, key) == ("statistics", 3)]
+    assert times[1] - times[0] >= 0.2
+    stats = pd.concat([page["anime-stats"] for page in pages])
+    assert sorted(stats["anime_id"]) == [1, 2, 3, 4, 5, 6]
+
+
+def test_throttled_requests_back_off_exponentially(api, api_config):
+    stub, _ = api
+    stub.throttled = {1: 2}
+    list(fetch.fetch_batches(api_config, ["anime-stats"]))
+    times = [at for name, key, at in stub.requests if (name, key) == ("statistics", 1)]
+    assert len(times) == 3
+    # backoff, then twice the backoff
+    assert times[1] - times[0] >= 0.05
+    assert times[2] - times[1] >= 0.1
+
+
+def test_requests_fail_once_the_retries_run_out(api, api_config):
+    stub, _ = api
+    stub.throttled = {2: 10}
+    api_config["api"]["retries"] = 1
+    with pytest.raises(RuntimeError, match="failed after 2 tries"):
+        list(fetch.fetch_batches(api_config, SOURCES))
+    # The page is not recorded as fetched
+    assert not os.path.exists(
+        os.path.join(api_config["api"]["state-dir"], "cursor.json")
+    )
+
+
+def test_token_bucket_paces_requests():
+    async def acquire(bucket, count):
+        started = time.monotonic()
+        sent = []
+        for _ in range(count):
+            await bucket.acquire()
+            sent.append(time.monotonic() - started)
+        return sent
+
+    sent = asyncio.run(acquire(fetch.TokenBucket(rate=20, burst=2), 6))
+    # The burst goes out at once, then one request every 1 / rate seconds
+    assert sent[1] < 0.04
+    assert sent[-1] >= (6 - 2) / 20 * 0.9
+    gaps = [b - a for a, b in zip(sent[2:], sent[3:])]
+    assert min(gaps) >= 0.9 / 20
+
+
+def test_fetch_is_paced_by_the_token_bucket(api, api_config):
+    stub, _ = api
+    api_config["api"].update({"rate": 20, "burst": 1})
+    list(fetch.fetch_batches(api_config, SOURCES))
+    times = [at for _, _, at in stub.requests]
+    # 3 listing pages and 6 statistics, one token each
+    assert len(times) == 9
+    assert times[-1] - times[0] >= (9 - 1) / 20 * 0.9
+
+
+def test_interrupted_fetch_resumes_from_its_cursor(api, api_config):
+    stub, _ = api
+    batches = fetch.fetch_batches(api_config, SOURCES)
+    first = next(batches)
+    batches.close()
+    assert read_cursor(api_config)["pages"] == [1]
+    assert read_cursor(api_config)["next-page"] == 2
+    stub.requests.clear()
+    pages = list(fetch.fetch_batches(api_config, SOURCES))
+    # Only the pages not fetched yet are requested
+    assert stub.fetched("anime") == [2, 3]
+    assert stub.fetched("statistics") == [3, 4, 5, 6]
+    assert [list(page["all-anime"]["id"]) for page in pages] == [[1, 2], [3, 4], [5, 6]]
+    for table in SOURCES:
+        pd.testing.assert_frame_equal(pages[0][table], first[table])
+    assert read_cursor(api_config)["pages"] == [1, 2, 3]
+
+
+def test_max_pages_leaves_a_cursor_to_resume_from(api, api_config):
+    stub, _ = api
+    api_config["api"]["max-pages"] = 2
+    assert len(list(fetch.fetch_batches(api_config, SOURCES))) == 2
+    assert read_cursor(api_config)["next-page"] == 3
+    api_config["api"]["max-pages"] = None
+    stub.requests.clear()
+    assert len(list(fetch.fetch_batches(api_config, SOURCES))) == 3
+    assert stub.fetched("anime") == [3]
+
+
+def test_cursor_of_another_day_starts_over(api, api_config):
+    stub, _ = api
+    state = api_config["api"]["state-dir"]
+    os.makedirs(state)
+    with open(os.path.join(state, "cursor.json"), "w", encoding="utf-8") as file:
+        json.dump({"load-date": "2000-01-01", "next-page": None, "pages": [1]}, file)
+    assert len(list(fetch.fetch_batches(api_config, SOURCES))) == 3
+    assert stub.fetched("anime") == [1, 2, 3]
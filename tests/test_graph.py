@@ -0,0 +1,46 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Tests of the stage graph (graph.py) on the repository's tables.yml
+"""
+import graph
+
+
+def test_upstream_puts_every_table_after_its_inputs(config):
+    ordered = graph.upstream(config, ["anime-stats-scores-pct"])
+    assert ordered == [
+        "all-anime",
+        "anime-scores",
+        "anime-votes-pct",
+        "anime-stats",
+        "anime-stats-scores-pct",
+    ]
+
+
+def test_upstream_lists_shared_inputs_once(config):
+    ordered = graph.upstream(config, ["anime-votes-raw", "anime-votes-pct"])
+    assert ordered == ["anime-scores", "anime-votes-raw", "anime-votes-pct"]
+    assert graph.upstream(config, ["all-anime"]) == ["all-anime"]
+
+
+def test_prune_definition_keeps_the_keys_and_the_given_columns(config):
+    pruned = graph.prune_definition(config["all-anime"], {"anime_title", "aired_to"})
+    schema = pruned["csv-schema"]
+    # The dupe-index and the partition-key, by their raw names, are always read
+    assert schema["usecols"] == ["id", "title", "aired_to"]
+    assert schema["dtypes"] == {"id": "int64"}
+    assert schema["dates"] == {"aired_to": "ISO8601"}
+    assert schema["categories"] == []
+    assert pruned["datecols"] == ["aired_to"]
+    assert pruned["day-keys"] == ["aired_to"]
+    assert pruned["conversion"] == {}
+    assert pruned["compact"] == {
+        "anime_id": "Int32",
+        "anime_title": "string[pyarrow]",
+    }
+
+
+def test_prune_definition_leaves_the_definition_untouched(config):
+    usecols = list(config["all-anime"]["csv-schema"]["usecols"])
+    graph.prune_definition(config["all-anime"], {"status"})
+    assert config["all-anime"]["csv-schema"]["usecols"] == usecols
@@ -0,0 +1,43 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Tests that incremental loads (etl.upsert_db) only see the rows
+              whose content changed
+"""
+import numpy as np
+import pandas as pd
+import etl
+
+
+def scores(load_date: str) -> pd.DataFrame:
+    """Returns the same anime-scores rows loaded on the given day"""
+    return pd.DataFrame(
+        {
+            "anime_id": [1, 1, 2],
+            "score": [1, 2, 1],
+            "votes": [10, 20, 30],
+            "percentage": [33.3, 66.7, 100.0],
+            "load_date": pd.to_datetime([load_date] * 3),
+        }
+    )
+
+
+def test_a_new_load_date_alone_changes_no_row(config, monkeypatch):
+    dates = pd.DatetimeIndex(["2022-06-27", "2022-06-28"])
+    monkeypatch.setattr(
+        etl, "dim_day_keys", lambda engine: (dates, np.array([5, 6]), 1)
+    )
+    ignore = config["incremental"]["ignore-columns"]
+    # The frames as load_table upserts them, with their day keys
+    first = etl.with_day_keys(scores("2022-06-27"), "anime-scores", config, None)
+    second = etl.with_day_keys(scores("2022-06-28"), "anime-scores", config, None)
+    assert list(first["load_date_key"]) != list(second["load_date_key"])
+    pd.testing.assert_series_equal(
+        etl.row_hashes(first, ignore), etl.row_hashes(second, ignore)
+    )
+    changed = second.assign(votes=[10, 21, 30])
+    assert list(etl.row_hashes(first, ignore) != etl.row_hashes(changed, ignore)) == [
+        False,
+        True,
+        False,
+    ]
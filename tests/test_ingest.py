@@ -0,0 +1,55 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Tests that sources read in chunks, each chunk cleaned as it is
+              read, come out the same as sources read and cleaned whole
+"""
+import pandas as pd
+import pytest
+import etl
+import generate_data
+
+
+@pytest.fixture
+def paths(config, tmp_path) -> dict:
+    """Returns the path of the synthetic raw data of each source table"""
+    files = generate_data.generate(str(tmp_path), 200, duplicate_rate=0.1, seed=2)
+    return dict(zip(config["source-tables"], files))
+
+
+@pytest.mark.parametrize("chunksize", [97, 1000, 100000])
+def test_chunks_are_cleaned_like_the_whole_file(config, paths, chunksize):
+    config["csv-engine"] = "c"
+    whole = etl.extract_sources(config, paths)
+    for table in paths:
+        config[table]["csv-chunksize"] = chunksize
+    chunked = etl.extract_sources(config, paths)
+    for table, path in paths.items():
+        pd.testing.assert_frame_equal(chunked[table], whole[table], obj=table)
+        # The duplicates repeated at the end of the file were removed
+        keys = config[table]["dupe-index"]
+        assert not chunked[table].duplicated(keys).any()
+        raw = pd.read_csv(path)
+        assert len(chunked[table]) < len(raw)
+
+
+def test_shipped_csv_engine_reads_like_the_c_parser(config, paths):
+    # The engine set in tables.yml, left as shipped
+    shipped = etl.extract_sources(config, paths)
+    config["csv-engine"] = "c"
+    expected = etl.extract_sources(config, paths)
+    for table in paths:
+        pd.testing.assert_frame_equal(shipped[table], expected[table], obj=table)
+
+
+def test_pyarrow_skips_bad_lines(config, tmp_path):
+    path = tmp_path / "anime_scores.csv"
+    path.write_text(
+        "anime_id,score,votes,percentage,load_date\n"
+        "1,1,10,50.0,2022-06-27\n"
+        "1,2,10,50.0,2022-06-27,extra\n"
+        "2,1,5,100.0,2022-06-27\n"
+    )
+    schema = config["anime-scores"]["csv-schema"]
+    df = next(etl.read_raw_data(str(path), schema, "pyarrow"))
+    assert list(df["anime_id"]) == [1, 2]
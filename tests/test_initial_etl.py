@@ -0,0 +1,83 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Tests of the checks and the planning of a run (initial_etl.py)
+"""
+import pytest
+import initial_etl
+
+
+def test_repository_config_is_valid(config):
+    assert initial_etl.validate_config(config) == []
+
+
+def test_validate_config_reports_each_problem(config):
+    del config["watch"]
+    config["source"] = "ftp"
+    config["raw-data-loc"] = config["raw-data-loc"][:2]
+    del config["anime-votes-raw"]["pivot-on"]
+    config["anime-votes-pct"]["inputs"] = ["anime-votes-pct"]
+    config["anime-stats"]["loader"] = "bcp"
+    config["anime-scores"]["keys"] = {"foreign": ["anime_id"]}
+    config["all-anime"]["indexes"] = [[]]
+    config["anime-stats-scores-pct"]["tablename"] = "anime_stats_and_scores_raw"
+    assert initial_etl.validate_config(config) == [
+        "missing section watch",
+        "raw-data-loc and source-tables differ in length",
+        "source must be csv or api, not ftp",
+        "all-anime: every index must be a list of columns",
+        "anime-stats: unknown loader bcp",
+        "anime-scores: keys.foreign must be primary/unique columns",
+        "anime-votes-raw: missing pivot-on",
+        "anime-votes-pct: unknown input anime-votes-pct",
+        "anime-stats-scores-pct: same table as anime-stats-scores-raw "
+        "(anime.anime_stats_and_scores_raw)",
+    ]
+
+
+def test_validate_config_reports_missing_definitions(config):
+    del config["anime-stats"]
+    config["all-anime"]["transform"] = "pivot"
+    problems = initial_etl.validate_config(config)
+    assert "anime-stats: no definition" in problems
+    assert "all-anime: only source tables are cleaned" in problems
+    assert "all-anime: missing inputs" in problems
+
+
+def test_plan_tables_defaults_to_every_table(config):
+    targets, computed, built, tables, loads = initial_etl.plan_tables(
+        config, None, False
+    )
+    every_table = config["source-tables"] + initial_etl.DERIVED_TABLES
+    assert targets == every_table
+    assert set(computed) == set(every_table)
+    assert built == []
+    assert tables == computed
+    assert loads == targets
+
+
+def test_plan_tables_computes_only_what_the_targets_need(config):
+    targets, computed, built, tables, loads = initial_etl.plan_tables(
+        config, ["anime-votes-pct"], False
+    )
+    assert targets == ["anime-votes-pct"]
+    assert computed == ["anime-scores", "anime-votes-pct"]
+    assert built == []
+    assert tables == computed
+    # Only the target is loaded, its inputs are computed in memory
+    assert loads == ["anime-votes-pct"]
+
+
+def test_plan_tables_in_the_database_loads_the_inputs(config):
+    targets, computed, built, tables, loads = initial_etl.plan_tables(
+        config, ["anime-votes-pct"], True
+    )
+    assert built == ["anime-votes-pct"]
+    assert tables == ["anime-scores"]
+    # The derived table is built from its loaded input
+    assert loads == ["anime-scores"]
+
+
+def test_plan_tables_rejects_unknown_tables(config):
+    with pytest.raises(ValueError, match="Unknown tables"):
+        initial_etl.plan_tables(config, ["anime-votes"], False)
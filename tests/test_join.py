@@ -0,0 +1,123 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Tests that the planned etl.join_tables builds the same joined
+              tables as the original etl.join_data
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import etl
+
+JOIN_TABLES = ["anime-stats-scores-raw", "anime-stats-scores-pct"]
+LOAD_DATE = pd.Timestamp("2022-06-27")
+
+
+def all_anime(ids: list) -> pd.DataFrame:
+    """Returns cleaned all-anime rows of the given anime"""
+    return pd.DataFrame(
+        {
+            "anime_id": ids,
+            "anime_title": [f"Anime {anime_id}" for anime_id in ids],
+            "status": pd.Categorical(
+                ["Finished Airing" if anime_id % 2 else "Airing" for anime_id in ids]
+            ),
+            "rating": pd.Categorical(["PG-13"] * len(ids)),
+            "score": [anime_id / 1.5 for anime_id in ids],
+            "favorites": [anime_id * 10 for anime_id in ids],
+            "airing": [anime_id % 2 == 0 for anime_id in ids],
+            "aired_from": pd.Timestamp("2001-04-01"),
+            "aired_to": [
+                pd.NaT if anime_id % 2 == 0 else pd.Timestamp("2002-03-31")
+                for anime_id in ids
+            ],
+            "load_date": LOAD_DATE,
+        }
+    )
+
+
+def anime_stats(ids: list) -> pd.DataFrame:
+    """Returns cleaned anime-stats rows of the given anime"""
+    stats = ["watching", "completed", "on_hold", "dropped", "plan_to_watch"]
+    df = pd.DataFrame({"anime_id": ids})
+    for offset, col in enumerate(stats):
+        df[col] = [anime_id * 100 + offset for anime_id in ids]
+    df["total"] = df[stats].sum(axis=1)
+    # A later load date than all-anime, which join_data leaves out
+    df["load_date"] = LOAD_DATE + pd.Timedelta(days=1)
+    return df
+
+
+def anime_votes(ids: list, config: dict) -> dict:
+    """Returns the anime-votes-raw and anime-votes-pct tables of the given anime"""
+    scores = pd.DataFrame(
+        [
+            (anime_id, score, score * anime_id, score / 0.55)
+            for anime_id in ids
+            for score in range(1, 11)
+        ],
+        columns=["anime_id", "score", "votes", "percentage"],
+    )
+    scores["load_date"] = LOAD_DATE
+    tables = ["anime-votes-raw", "anime-votes-pct"]
+    votes = etl.create_pivot_tables(scores, config, tables)
+    return {table: df.reset_index(drop=True) for table, df in zip(tables, votes)}
+
+
+def frames(config: dict, anime: list, votes: list, stats: list) -> dict:
+    """Returns the join inputs, each holding the given anime ids"""
+    return {
+        "all-anime": all_anime(anime),
+        "anime-stats": anime_stats(stats),
+        **anime_votes(votes, config),
+    }
+
+
+def assert_same_joins(data: dict, config: dict):
+    """Checks join_tables against join_data for both joined tables"""
+    actual = etl.join_tables(config, data, JOIN_TABLES)
+    assert list(actual) == JOIN_TABLES
+    for table in JOIN_TABLES:
+        expected = etl.join_data(
+            config, *[data[name] for name in config[table]["inputs"]]
+        )
+        pd.testing.assert_frame_equal(actual[table], expected)
+
+
+def test_same_anime(config):
+    ids = [3, 1, 2]
+    assert_same_joins(frames(config, ids, ids, ids), config)
+
+
+def test_row_subsets(config):
+    # Only anime 2, 4 and 5 are in all three inputs
+    data = frames(config, [5, 1, 4, 2, 7], [1, 2, 3, 4, 5, 6], [2, 4, 5, 6, 7])
+    data["anime-stats"] = data["anime-stats"].iloc[::-1].reset_index(drop=True)
+    assert_same_joins(data, config)
+    joined = etl.join_tables(config, data, JOIN_TABLES)
+    assert list(joined["anime-stats-scores-raw"]["anime_id"]) == [5, 4, 2]
+
+
+def test_no_shared_anime(config):
+    assert_same_joins(frames(config, [1, 2], [3, 4], [1, 2]), config)
+
+
+def test_missing_values(config):
+    data = frames(config, [1, 2, 3], [1, 2, 3], [1, 2, 3])
+    data["anime-stats"].loc[1, "dropped"] = np.nan
+    data["anime-votes-pct"].loc[2, 7] = np.nan
+    assert_same_joins(data, config)
+
+
+def test_compact_dtypes(config):
+    data = frames(config, [4, 2, 1, 3], [1, 2, 3], [2, 3, 4])
+    for name in ["all-anime", "anime-stats"]:
+        data[name] = data[name].astype(config[name]["compact"])
+    assert_same_joins(data, config)
+
+
+@pytest.mark.parametrize("table", JOIN_TABLES)
+def test_load_date_of_all_anime(config, table):
+    data = frames(config, [1, 2], [1, 2], [1, 2])
+    joined = etl.join_tables(config, data, [table])[table]
+    assert (joined["load_date"] == LOAD_DATE).all()
@@ -0,0 +1,31 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Tests of the table metadata applied after a load (etl.metadata_sql)
+"""
+import etl
+import initial_etl
+import sql
+
+
+def test_every_table_gets_all_the_metadata(config):
+    tables = config["source-tables"] + initial_etl.DERIVED_TABLES
+    metadata = etl.metadata_sql(config, tables)
+    statements = [etl.metadata_sql(config, [table]) for table in tables]
+    assert sorted(filter(None, statements)) == sorted(sql.METADATA.values())
+    assert metadata == "".join(statements)
+
+
+def test_only_the_given_tables_get_their_metadata(config):
+    metadata = etl.metadata_sql(config, ["all-anime", "anime-votes-raw"])
+    assert metadata == sql.METADATA["anime.all_anime"]
+    assert "anime.stats" not in metadata
+
+
+def test_semicolons_inside_comments_are_kept(config, monkeypatch):
+    statement = """
+    COMMENT ON TABLE anime.all_anime
+        IS 'Every anime; one row per load';
+"""
+    monkeypatch.setitem(sql.METADATA, "anime.all_anime", statement)
+    assert etl.metadata_sql(config, ["all-anime"]) == statement
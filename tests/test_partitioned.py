@@ -0,0 +1,89 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Tests that an out of core run (scheduler.run_partitioned)
+              computes the same tables as an in-memory run
+              (scheduler.run_pipeline), on data from generate_data.py
+"""
+import pandas as pd
+import pytest
+import etl
+import generate_data
+import graph
+import initial_etl
+import scheduler
+
+PARTITIONS = 4
+
+
+@pytest.fixture
+def data_config(config, tmp_path):
+    """Returns the configuration reading synthetic raw data"""
+    paths = generate_data.generate(str(tmp_path / "data"), 300, seed=1)
+    config["raw-data-loc"] = paths
+    config["csv-engine"] = "c"
+    config["partitioned"]["chunksize"] = 1000
+    return config
+
+
+def in_memory(config: dict, tables: list) -> dict:
+    """Returns the tables computed like run_pipeline computes them"""
+    frames = {}
+    for stage in graph.build_stages(config, tables):
+        frames.update(scheduler.compute_stage(config, stage, frames))
+    return frames
+
+
+def out_of_core(config: dict, tables: list, directory: str) -> dict:
+    """Returns the tables computed like run_partitioned, every partition combined"""
+    stages = graph.build_stages(config, tables)
+    for stage in stages:
+        for table, path in stage["paths"].items():
+            etl.spill_source(config, table, path, directory, PARTITIONS)
+    parts = [
+        scheduler.compute_partition(config, stages, directory, part)[0]
+        for part in range(PARTITIONS)
+    ]
+    return {
+        table: etl.concat_chunks([frames[table] for frames in parts])
+        for table in tables
+    }
+
+
+def by_key(df: pd.DataFrame, keys: list) -> pd.DataFrame:
+    """Returns the rows sorted by the given key, with a fresh index"""
+    return df.sort_values(keys).reset_index(drop=True)
+
+
+def test_partitioned_matches_in_memory(data_config, tmp_path):
+    tables = data_config["source-tables"] + initial_etl.DERIVED_TABLES
+    expected = in_memory(data_config, tables)
+    spill = tmp_path / "spill"
+    spill.mkdir()
+    actual = out_of_core(data_config, tables, str(spill))
+    for table in tables:
+        keys = data_config[table]["dupe-index"]
+        # The same rows, though not in the same order
+        assert set(map(tuple, actual[table][keys].to_numpy())) == set(
+            map(tuple, expected[table][keys].to_numpy())
+        ), table
+        assert not actual[table].duplicated(keys).any(), table
+        pd.testing.assert_frame_equal(
+            by_key(actual[table], keys), by_key(expected[table], keys), obj=table
+        )
+
+
+def test_partitions_share_their_categories(data_config, tmp_path):
+    tables = data_config["source-tables"]
+    stages = graph.build_stages(data_config, tables)
+    for stage in stages:
+        for table, path in stage["paths"].items():
+            etl.spill_source(data_config, table, path, str(tmp_path), 50)
+    dtypes = [
+        scheduler.compute_partition(data_config, stages, str(tmp_path), part)[0][
+            "all-anime"
+        ].dtypes
+        for part in range(50)
+    ]
+    for col in ["status", "rating"]:
+        assert len({str(dtype[col].categories.tolist()) for dtype in dtypes}) == 1
@@ -0,0 +1,119 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Tests that the single-pass etl.create_pivot_tables builds the
+              same votes tables as the original etl.create_pivot_table
+"""
+import re
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy.dialects import postgresql
+import etl
+
+PIVOT_TABLES = ["anime-votes-raw", "anime-votes-pct"]
+
+
+def scores(rows: list) -> pd.DataFrame:
+    """Returns cleaned anime-scores rows from (anime_id, score, votes, percentage)"""
+    df = pd.DataFrame(rows, columns=["anime_id", "score", "votes", "percentage"])
+    df["load_date"] = pd.Timestamp("2022-06-27")
+    return df
+
+
+def full_scores(ids: list) -> list:
+    """Returns the rows of every score from 1 to 10 of each of the given anime"""
+    return [
+        (anime_id, score, score * anime_id, score / 0.55)
+        for anime_id in ids
+        for score in range(1, 11)
+    ]
+
+
+def assert_same_pivots(df: pd.DataFrame, config: dict):
+    """Checks create_pivot_tables against create_pivot_table for both tables"""
+    actual = etl.create_pivot_tables(df, config, PIVOT_TABLES)
+    for table, got in zip(PIVOT_TABLES, actual):
+        expected = etl.create_pivot_table(df, config, table)
+        pd.testing.assert_frame_equal(got, expected)
+        assert list(got.columns) == config[table]["columns"]
+        assert list(got.dtypes) == list(expected.dtypes)
+
+
+def test_full_scores(config):
+    assert_same_pivots(scores(full_scores([3, 1, 2])), config)
+
+
+def test_single_anime(config):
+    assert_same_pivots(scores(full_scores([7])), config)
+
+
+def test_missing_scores(config):
+    rows = [row for row in full_scores([1, 2, 3]) if row[:2] not in {(1, 4), (2, 9)}]
+    assert_same_pivots(scores(rows), config)
+
+
+def test_missing_values(config):
+    df = scores(full_scores([1, 2, 3]))
+    df.loc[(df["anime_id"] == 2) & (df["score"] == 5), "votes"] = np.nan
+    df.loc[df["anime_id"] == 3, "percentage"] = np.nan
+    # Anime 3 has no percentages at all, so it is left out of anime-votes-pct
+    assert_same_pivots(df, config)
+    pct = etl.create_pivot_tables(df, config, PIVOT_TABLES)[1]
+    assert list(pct["anime_id"]) == [1, 2]
+
+
+def test_scores_outside_the_columns(config):
+    rows = full_scores([1, 2]) + [(1, 0, 5, 1.0), (2, 11, 6, 2.0), (3, 11, 7, 3.0)]
+    # Anime 3 only has an unlisted score, so it is kept with missing values
+    assert_same_pivots(scores(rows), config)
+
+
+def test_score_missing_for_every_anime(config):
+    rows = [row for row in full_scores([1, 2]) if row[1] != 10]
+    df = scores(rows)
+    # pivot_table leaves out the column, which create_pivot_table then fails on
+    with pytest.raises(KeyError):
+        etl.create_pivot_table(df, config, "anime-votes-raw")
+    votes, _ = etl.create_pivot_tables(df, config, PIVOT_TABLES)
+    assert list(votes.columns) == config["anime-votes-raw"]["columns"]
+    assert votes[10].isna().all()
+
+
+def test_compact_dtypes_are_kept(config):
+    df = scores(full_scores([1, 2]))
+    df.loc[0, "votes"] = np.nan
+    df = df.astype({"anime_id": "Int32", "votes": "Int32", "percentage": "float32"})
+    votes, pct = etl.create_pivot_tables(df, config, PIVOT_TABLES)
+    assert set(votes.dtypes[2:]) == {pd.Int32Dtype()}
+    assert set(pct.dtypes[2:]) == {np.dtype("float32")}
+    expected = etl.create_pivot_table(df, config, "anime-votes-raw")
+    pd.testing.assert_frame_equal(
+        votes.astype({col: "float64" for col in range(1, 11)}),
+        expected.astype({col: "float64" for col in range(1, 11)}),
+        check_index_type=False,
+        check_dtype=False,
+    )
+
+
+def crosstab_types(query: str) -> dict:
+    """Returns the column types declared in the crosstab() of a pivot_sql query"""
+    columns = re.search(r"AS ct\((.*)\)", query).group(1).split(", ")
+    return dict(column.replace('"', "").split(" ", 1) for column in columns)
+
+
+@pytest.mark.parametrize("compact", [True, False])
+def test_in_database_pivots_have_the_pandas_types(config, compact):
+    source = config["anime-scores"]
+    dtypes = source["compact"] if compact else source["csv-schema"]["dtypes"]
+    if not compact:
+        del source["compact"]
+    df = scores(full_scores([1, 2])).astype(dtypes)
+    for table, pivot in zip(
+        PIVOT_TABLES, etl.create_pivot_tables(df, config, PIVOT_TABLES)
+    ):
+        expected = {
+            str(col): column_type().compile(dialect=postgresql.dialect())
+            for col, column_type in etl.sql_types(pivot).items()
+        }
+        assert crosstab_types(etl.pivot_sql(config, table)) == expected
@@ -0,0 +1,127 @@
+"""
+@Author: Martin Arroyo
+@Email: martinm.arroyo7@gmail.com
+@Description: Tests of the run manifest (runs.py) on an in-memory SQLite
+              database standing in for Postgres
+"""
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import StaticPool
+import runs
+import sql
+
+KEYS = {"all-anime": "a1", "anime-stats": "s1", "anime-scores": "c1"}
+
+
+@pytest.fixture
+def engine():
+    """Returns an engine over an in-memory database with public.etl_runs"""
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, _):
+        dbapi_connection.create_function("NOW", 0, lambda: "now")
+        dbapi_connection.execute("ATTACH DATABASE ':memory:' AS public")
+
+    with engine.connect() as conn:
+        with conn.begin():
+            # SQLite only takes expressions as defaults in parentheses
+            conn.execute(text(sql.CREATE_ETL_RUNS.replace("NOW()", "(NOW())")))
+    yield engine
+    engine.dispose()
+
+
+def start(engine, run_id: str):
+    """Records a run as running, like runs.start once the table exists"""
+    runs.record(engine, run_id, "run", "running", {runs.RUN: 0}, {})
+
+
+def test_completed_only_returns_successes_with_the_same_inputs(engine):
+    start(engine, "20220627T000000")
+    runs.record(
+        engine,
+        "20220627T000000",
+        "load",
+        "success",
+        {"all-anime": 10, "anime-stats": 5},
+        KEYS,
+    )
+    runs.record(
+        engine,
+        "20220627T000000",
+        "load",
+        "failed",
+        {"anime-scores": RuntimeError("boom")},
+        KEYS,
+    )
+    changed = dict(KEYS, **{"anime-stats": "s2"})
+    assert runs.completed(engine, "20220627T000000", "load", changed) == {
+        "all-anime": 10
+    }
+    assert runs.completed(engine, "20220627T000000", "index", KEYS) == {}
+    # Only the tables asked about are returned
+    assert runs.completed(engine, "20220627T000000", "load", {"anime-stats": "s1"}) == {
+        "anime-stats": 5
+    }
+
+
+def test_record_replaces_the_status_of_a_stage(engine):
+    start(engine, "20220627T000000")
+    failed = {"all-anime": RuntimeError("boom")}
+    runs.record(engine, "20220627T000000", "load", "failed", failed, KEYS)
+    runs.record(engine, "20220627T000000", "load", "success", {"all-anime": 3}, KEYS)
+    assert runs.completed(engine, "20220627T000000", "load", KEYS) == {"all-anime": 3}
+    with engine.connect() as conn:
+        error = conn.execute(
+            text("SELECT error FROM public.etl_runs WHERE stage = 'load'")
+        ).scalar()
+    assert error is None
+
+
+def test_carry_over_without_a_previous_run(engine):
+    start(engine, "20220627T000000")
+    assert runs.carry_over(engine, "20220627T000000", "load", KEYS) == {}
+
+
+def test_carry_over_skips_what_the_previous_run_completed(engine):
+    start(engine, "20220627T000000")
+    runs.record(engine, "20220627T000000", "load", "success", {"all-anime": 10}, KEYS)
+    runs.record(
+        engine,
+        "20220627T000000",
+        "load",
+        "failed",
+        {"anime-stats": RuntimeError("boom")},
+        KEYS,
+    )
+    start(engine, "20220627T010000")
+    assert runs.carry_over(engine, "20220627T010000", "load", KEYS) == {"all-anime": 10}
+    # Recorded as skipped, so a resume of this run skips it as well
+    assert runs.completed(engine, "20220627T010000", "load", KEYS) == {"all-anime": 10}
+    start(engine, "20220627T020000")
+    assert runs.carry_over(engine, "20220627T020000", "load", KEYS) == {"all-anime": 10}
+
+
+def test_carry_over_only_looks_at_the_latest_run(engine):
+    start(engine, "20220627T000000")
+    runs.record(engine, "20220627T000000", "swap", "success", {"all-anime": None}, KEYS)
+    start(engine, "20220627T010000")
+    start(engine, "20220627T020000")
+    assert runs.carry_over(engine, "20220627T020000", "swap", KEYS) == {}
+
+
+def test_carry_over_ignores_changed_inputs(engine):
+    start(engine, "20220627T000000")
+    runs.record(
+        engine,
+        "20220627T000000",
+        "swap",
+        "success",
+        {"all-anime": None, "anime-stats": None},
+        KEYS,
+    )
+    start(engine, "20220627T010000")
+    changed = dict(KEYS, **{"all-anime": "a2"})
+    assert runs.carry_over(engine, "20220627T010000", "swap", changed) == {
+        "anime-stats": None
+    }